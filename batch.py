@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from computer import Computer
+from headless import parse_input, run
+from input_stream import DEFAULT_SEED, RandomInput
+from output_log import OutputLog
+from preprocessor import load_program
+from snapshot import Snapshot
+
+DEFAULT_OUTPUT_CAPACITY = 64
+
+
+@dataclass
+class Job:
+    program: str
+    # (cycle, slot, value) like headless --input
+    inputs: list[tuple[int, int, int]] = field(default_factory=list)
+    cycles: int | None = None
+    output_capacity: int = DEFAULT_OUTPUT_CAPACITY
+    # seed for the random values of input 7
+    seed: int = DEFAULT_SEED
+
+
+@dataclass
+class Result:
+    digest: str
+    instruction_pointer: int
+    clock_cycle: int
+    running: bool
+    registers: tuple[int, int, int]
+    output: list[tuple[int, int]]
+    output_count: int
+    # np.packbits of the 64x64 lamps
+    screen: bytes
+    error: str | None = None
+
+    def to_json(self) -> dict:
+        return {
+            "digest": self.digest,
+            "instruction_pointer": self.instruction_pointer,
+            "clock_cycle": self.clock_cycle,
+            "running": self.running,
+            "registers": self.registers,
+            "output": self.output,
+            "output_count": self.output_count,
+            "screen": self.screen.hex(),
+            "error": self.error,
+        }
+
+
+# each worker parses and block-compiles a program once, later jobs for the
+# same program restore its initial snapshot instead
+prepared: dict[str, tuple[Computer, Snapshot]] = {}
+
+
+def prepare(program: str) -> tuple[Computer, Snapshot]:
+    if program not in prepared:
+        computer = Computer(load_program(program), blocks=True)
+        prepared[program] = computer, computer.snapshot()
+    return prepared[program]
+
+
+def state_digest(computer: Computer) -> str:
+    state = computer.state
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.array([state.instruction_pointer, state.clock_cycle, state.a, state.b, state.c,
+                            state.running, state.loaded_bank_index], np.int64).tobytes())
+    for array in (state.cache_slots, state.ram, state.inputs, computer.screen, computer.screenbuffer):
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def run_job(job: Job) -> Result:
+    computer, initial = prepare(job.program)
+    computer.restore(initial)
+    computer.output = OutputLog(job.output_capacity)
+    computer.input_provider = RandomInput(job.seed)
+    error = None
+    try:
+        run(computer, job.cycles, job.inputs)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    state = computer.state
+    return Result(
+        digest=state_digest(computer),
+        instruction_pointer=state.instruction_pointer,
+        clock_cycle=state.clock_cycle,
+        running=state.running,
+        registers=(state.a, state.b, state.c),
+        output=[(register, int(value)) for register, value in computer.output],
+        output_count=computer.output.count,
+        screen=np.packbits(computer.screen).tobytes(),
+        error=error,
+    )
+
+
+def run_batch(jobs: list[Job], workers: int | None = None) -> list[Result]:
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+    # large chunks keep jobs for the same program on the same worker
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(run_job, jobs, chunksize=chunksize))
+
+
+def parse_job(line: str, default_program: str | None, default_cycles: int | None) -> Job:
+    # {"program": "code.txt", "inputs": ["3=5", "100:2=1"], "cycles": 100000, "seed": 1}
+    data = json.loads(line)
+    program = data.get("program", default_program)
+    if program is None:
+        raise ValueError(f"Job without a program: {line.strip()}")
+    return Job(program, [parse_input(text) for text in data.get("inputs", [])],
+               data.get("cycles", default_cycles), data.get("output_capacity", DEFAULT_OUTPUT_CAPACITY),
+               data.get("seed", DEFAULT_SEED))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run many program/input jobs on a process pool.")
+    parser.add_argument("jobs", help="JSON lines file with one job per line, - for stdin")
+    parser.add_argument("-p", "--program", help="program for jobs that don't name one")
+    parser.add_argument("-n", "--cycles", type=int, default=None, help="cycle budget for jobs without one")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines result file, stdout by default")
+    args = parser.parse_args(argv)
+
+    with (sys.stdin if args.jobs == "-" else open(args.jobs)) as f:
+        jobs = [parse_job(line, args.program, args.cycles) for line in f if line.strip()]
+
+    start = time.perf_counter()
+    results = run_batch(jobs, args.workers)
+    elapsed = time.perf_counter() - start
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for result in results:
+            out.write(json.dumps(result.to_json(), separators=(",", ":")) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    cycles = sum(result.clock_cycle for result in results)
+    print(f"{len(jobs)} jobs, {cycles:,} cycles in {elapsed:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
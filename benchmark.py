@@ -0,0 +1,390 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from ctypes import c_int16
+from random import randint
+
+import numpy as np
+
+from computer import Computer, RegisterFile, decode
+from input_stream import RANDOM_SLOT, RandomInput
+from lockstep import LockstepComputer
+from optimizer import measure as measure_savings, optimize
+from program import RSB_SUFFIX, Command, Program
+from timing import DEFAULT_TIMING, TimingModel
+
+DEFAULT_STEPS = 200_000
+
+
+def run_steps(computer: Computer, steps: int) -> float:
+    start = time.perf_counter()
+    for _ in range(steps):
+        if not computer.state.running:
+            break
+        computer.step()
+    return time.perf_counter() - start
+
+
+def same_state(first: Computer, second: Computer) -> bool:
+    return (first.state.instruction_pointer == second.state.instruction_pointer
+            and first.state.clock_cycle == second.state.clock_cycle
+            and (first.state.a, first.state.b, first.state.c) == (second.state.a, second.state.b, second.state.c)
+            and np.array_equal(first.state.cache_slots, second.state.cache_slots)
+            and np.array_equal(first.state.ram, second.state.ram)
+            and np.array_equal(first.state.loaded_bank, second.state.loaded_bank)
+            and list(first.output) == list(second.output)
+            and np.array_equal(first.screenbuffer, second.screenbuffer))
+
+
+def bench_engine(source: str, steps: int):
+    results = {}
+    for label, compiled in (("interpreter", False), ("compiled", True)):
+        computer = Computer(source, compiled=compiled)
+        elapsed = run_steps(computer, steps)
+        results[label] = computer
+        print(f"{label:>12}: {computer.state.clock_cycle / elapsed:>12,.0f} steps/s")
+    print("states match:", same_state(results["interpreter"], results["compiled"]))
+
+
+def bench_blocks(source: str, steps: int):
+    results = {}
+    for label, options in (("interpreter", {"compiled": False}), ("compiled", {}), ("blocks", {"blocks": True})):
+        computer = Computer(source, **options)
+        start = time.perf_counter()
+        computer.run(steps)
+        elapsed = time.perf_counter() - start
+        results[label] = computer
+        print(f"{label:>12}: {computer.state.clock_cycle / elapsed:>12,.0f} steps/s")
+    print("states match:", same_state(results["interpreter"], results["blocks"]))
+
+
+# ADD, SUB, MUL, LAH and jump comparisons in a counting loop
+ARITH_PROGRAM = """LAL 0
+SVA 0
+LA 0
+LBL 3
+ADD
+LBL 1
+SUB
+LBL 7
+MUL
+LAH 1
+SVA 0
+LB 0
+JG 14
+JMP 2
+LAL 0
+JMP 2"""
+
+
+# the same ADD/SUB/MUL/LAH/INB/compare mix, once through c_int16 objects the
+# way State used to store registers and once the way the compiled handlers do
+def ctypes_mix(rounds: int) -> int:
+    a, b = c_int16(0), c_int16(3)
+    for _ in range(rounds):
+        a.value = a.value + b.value
+        a.value = a.value - b.value
+        a.value = a.value * b.value
+        a.value = a.value | (1 << 8)
+        b.value = b.value + 1
+        _ = a.value > b.value
+    return a.value
+
+
+def register_file_mix(rounds: int) -> int:
+    registers = RegisterFile(b=3)
+    for _ in range(rounds):
+        registers.a = (registers.a + registers.b + 0x8000 & 0xFFFF) - 0x8000
+        registers.a = (registers.a - registers.b + 0x8000 & 0xFFFF) - 0x8000
+        registers.a = (registers.a * registers.b + 0x8000 & 0xFFFF) - 0x8000
+        registers.a = ((registers.a | 1 << 8) + 0x8000 & 0xFFFF) - 0x8000
+        registers.b = (registers.b + 1 + 0x8000 & 0xFFFF) - 0x8000
+        _ = registers.a > registers.b
+    return registers.a
+
+
+def bench_registers(source: str, steps: int):
+    rounds = steps // 6
+    results = []
+    for label, mix in (("ctypes", ctypes_mix), ("register file", register_file_mix)):
+        start = time.perf_counter()
+        results.append(mix(rounds))
+        elapsed = time.perf_counter() - start
+        print(f"{label:>13}: {rounds * 6 / elapsed:>12,.0f} register ops/s")
+    print("results match:", results[0] == results[1])
+    bench_engine(source, steps)
+
+
+# walks RAM with a stride of 17 cells, so every access goes through RC to
+# another bank first
+BANK_PROGRAM = """LAL 0
+SVA 0
+LB 0
+RC
+LA 0
+RW
+RR
+LBL 17
+ADD
+SVA 0
+JMP 2"""
+
+
+# RC followed by RW/RR, once with the copy back into ram that State used to
+# do on every switch and once by moving the bank offset
+def copy_switch_mix(rounds: int) -> int:
+    ram = np.zeros(1024, np.int16)
+    loaded_bank, index = np.zeros(16, np.int16), 0
+    for i in range(rounds):
+        bank = (i * 17 >> 4) & 63
+        if bank != index:
+            ram[index * 16:(index + 1) * 16] = loaded_bank
+            loaded_bank = ram[bank * 16:(bank + 1) * 16]
+            index = bank
+        loaded_bank[i & 15] = i & 0x7FFF
+        _ = int(loaded_bank[i & 15])
+    return int(ram.sum())
+
+
+def offset_switch_mix(rounds: int) -> int:
+    ram = np.zeros(1024, np.int16)
+    index = 0
+    for i in range(rounds):
+        bank = (i * 17 >> 4) & 63
+        if bank != index:
+            index = bank
+        ram[(index << 4) + (i & 15)] = i & 0x7FFF
+        _ = int(ram[(index << 4) + (i & 15)])
+    return int(ram.sum())
+
+
+def bench_banks(source: str, steps: int):
+    rounds = steps // 3
+    results = []
+    for label, mix in (("copy back", copy_switch_mix), ("bank offset", offset_switch_mix)):
+        start = time.perf_counter()
+        results.append(mix(rounds))
+        elapsed = time.perf_counter() - start
+        print(f"{label:>12}: {rounds / elapsed:>12,.0f} switches/s")
+    print("results match:", results[0] == results[1])
+    bench_blocks(source, steps)
+
+
+# counts input 0 down to zero, so machines with different inputs diverge at
+# the loop exit
+COUNTDOWN_PROGRAM = """LA 32
+SVA 0
+LA 0
+LBL 1
+SUB
+SVA 0
+LBL 0
+JG 2
+SVA 33
+STP"""
+
+
+def bench_lockstep(source: str, steps: int, machines: int = 1000):
+    inputs = np.random.default_rng(0).integers(0, 200, (machines, 8))
+    start = time.perf_counter()
+    computers = []
+    for row in inputs:
+        computer = Computer(source, blocks=True)
+        computer.state.inputs[:] = row
+        computer.run(steps)
+        computers.append(computer)
+    elapsed = time.perf_counter() - start
+    cycles = sum(computer.state.clock_cycle for computer in computers)
+    print(f"{'one by one':>12}: {cycles / elapsed:>12,.0f} steps/s")
+
+    start = time.perf_counter()
+    lockstep = LockstepComputer(source, inputs)
+    lockstep.run(steps)
+    elapsed = time.perf_counter() - start
+    print(f"{'lockstep':>12}: {lockstep.clock_cycle.sum() / elapsed:>12,.0f} steps/s")
+    print("states match:", all(same_state(computer, lockstep.computer(i)) for i, computer in enumerate(computers)))
+
+
+# lights the screen diagonal one lamp per loop, refreshing after each lamp
+SCREEN_PROGRAM = """LAL 0
+SVA 0
+LA 0
+SUP 8
+LB 0
+OR
+SVA 39
+LAL 4
+SVA 38
+LAL 1
+SVA 38
+LA 0
+LBL 1
+ADD
+LBL 63
+AND
+SVA 0
+JMP 2"""
+
+REFERENCE_PROGRAMS = {
+    "arithmetic": ARITH_PROGRAM,
+    "ram walk": BANK_PROGRAM,
+    "screen": SCREEN_PROGRAM,
+}
+
+
+def bench_suite(source: str, steps: int):
+    # emulator speed next to the estimated in-game runtime of the same cycles
+    timing = TimingModel.load(DEFAULT_TIMING)
+    programs = dict(REFERENCE_PROGRAMS)
+    if source:
+        programs["custom"] = source
+    print(f"{'program':>12} {'steps/s':>12} {'ticks/cycle':>12} {'in-game s':>12} {'speedup':>10}")
+    for label, program in programs.items():
+        computer = Computer(program, blocks=True, timing=timing)
+        start = time.perf_counter()
+        computer.run(steps)
+        elapsed = time.perf_counter() - start
+        report = timing.report(computer.state.clock_cycle, computer.state.ticks)
+        print(f"{label:>12} {computer.state.clock_cycle / elapsed:>12,.0f} {report['ticks_per_cycle']:>12.2f} "
+              f"{report['in_game_seconds']:>12,.1f} {report['in_game_seconds'] / elapsed:>9,.0f}x")
+
+
+# sums reads of the random input 7
+RANDOM_PROGRAM = """LA 39
+LB 0
+ADD
+SVA 0
+JMP 0"""
+
+
+# a global RNG call per read the way Computer.execute used to randomize
+# input 7, and the seeded provider drawing in batches
+def randint_mix(rounds: int) -> int:
+    total = 0
+    for _ in range(rounds):
+        total += randint(-32768, 32767)
+    return total
+
+
+def provider_mix(rounds: int) -> int:
+    provider = RandomInput(0)
+    inputs = np.zeros(8, np.int16)
+    total = 0
+    for _ in range(rounds):
+        total += provider.read(RANDOM_SLOT, 0, inputs)
+    return total
+
+
+def bench_inputs(source: str, steps: int):
+    for label, mix in (("randint", randint_mix), ("provider", provider_mix)):
+        start = time.perf_counter()
+        mix(steps)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>12}: {steps / elapsed:>12,.0f} reads/s")
+    first, second = Computer(source, input_provider=RandomInput(1)), Computer(source, input_provider=RandomInput(1))
+    elapsed = run_steps(first, steps)
+    run_steps(second, steps)
+    print(f"{'compiled':>12}: {first.state.clock_cycle / elapsed:>12,.0f} steps/s")
+    print("seeded runs match:", same_state(first, second))
+
+
+def measure(load) -> tuple[float, int, object]:
+    # timed and traced separately, tracing slows allocations down a lot
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, result
+
+
+def bench_loader(source: str, steps: int):
+    # the source repeated to about `steps` lines, loaded as one Command object
+    # per line the way Computer used to, from text into columns and from a
+    # mapped .rsb file
+    lines = source.split("\n")
+    text = "\n".join(lines * max(steps // len(lines), 1))
+    count = text.count("\n") + 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program" + RSB_SUFFIX)
+        with open(path, "wb") as f:
+            Program.parse(text).save(f)
+        loaders = (
+            ("objects", lambda: [(command, decode(command)) for command in map(Command, text.split("\n"))]),
+            ("text", lambda: Computer(text)),
+            ("rsb", lambda: Computer(Program.load(path))),
+        )
+        results = {}
+        for label, load in loaders:
+            elapsed, size, results[label] = measure(load)
+            print(f"{label:>12}: {count / elapsed:>12,.0f} lines/s {size / count:>8.1f} bytes/line")
+    print("programs match:", results["text"].opcodes == results["rsb"].opcodes
+          and results["text"].operands == results["rsb"].operands)
+
+
+# preprocessor style output: the 0x0F0F mask is built again although B still
+# holds it and B is set at the end of the loop but never read
+OPTIMIZER_PROGRAM = """LAL 0
+SVA 0
+LBL 15
+LBH 15
+LA 0
+AND
+SVA 39
+LBL 15
+LBH 15
+LA 0
+LBL 1
+ADD
+SVA 0
+LBL 0
+LBH 0
+JMP 2"""
+
+
+def bench_optimizer(source: str, steps: int):
+    timing = TimingModel.load(DEFAULT_TIMING)
+    start = time.perf_counter()
+    optimized = optimize(source)
+    elapsed = time.perf_counter() - start
+    length = len(optimized.addresses) - 1
+    print(f"{'optimize':>12}: {length:,} -> {len(optimized.program):,} lines in {elapsed * 1000:.1f} ms")
+    savings = measure_savings(source, optimized, steps, timing=timing)
+    # wall time of the emulator for the same work
+    for label, program, cycles in (("original", source, savings.cycles_before),
+                                   ("optimized", optimized.program, savings.cycles_after)):
+        computer = Computer(program, blocks=True, timing=timing)
+        start = time.perf_counter()
+        computer.run(cycles)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>12}: {computer.state.clock_cycle:>12,} cycles {computer.state.ticks:>12,} ticks "
+              f"{elapsed * 1000:>8.1f} ms")
+    print(f"cycles saved: {savings.cycles_saved:,} ({savings.cycles_saved / max(savings.cycles_before, 1):.1%})")
+    print("verified:", savings.verified)
+
+
+BENCHMARKS = {
+    "engine": (bench_engine, None),
+    "registers": (bench_registers, ARITH_PROGRAM),
+    "blocks": (bench_blocks, None),
+    "banks": (bench_banks, BANK_PROGRAM),
+    "lockstep": (bench_lockstep, COUNTDOWN_PROGRAM),
+    "suite": (bench_suite, ""),
+    "inputs": (bench_inputs, RANDOM_PROGRAM),
+    "loader": (bench_loader, None),
+    "optimizer": (bench_optimizer, OPTIMIZER_PROGRAM),
+}
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else "engine"
+    benchmark, source = BENCHMARKS[name]
+    if len(sys.argv) > 2 or source is None:
+        with open(sys.argv[2] if len(sys.argv) > 2 else "code.txt") as f:
+            source = f.read()
+    steps = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_STEPS
+    benchmark(source, steps)
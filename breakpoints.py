@@ -0,0 +1,166 @@
+from dataclasses import dataclass, field
+from typing import Any
+
+from program import moved_address
+
+# commands that can change each register, matched by name so EXECUTE
+# fallbacks are covered too
+REGISTER_WRITERS = {
+    "a": {"LA", "LAL", "LAH", "ADD", "SUB", "AND", "OR", "XOR", "SUP", "SDN", "MUL", "RR"},
+    "b": {"LB", "LBL", "LBH", "INB"},
+    "c": {"LCL"},
+}
+
+
+def namespace(computer) -> dict[str, Any]:
+    state = computer.state
+    return {
+        "A": state.a, "B": state.b, "C": state.c,
+        "cache": state.cache_slots, "ram": state.ram, "bank": state.loaded_bank,
+        "inputs": state.inputs, "ip": state.instruction_pointer, "cycle": state.clock_cycle,
+    }
+
+
+class Condition:
+    # either a boolean expression ("A > 100") or "<expression> changed"
+    def __init__(self, text: str):
+        self.text = text
+        self.changed = text.endswith(" changed")
+        expression = text[:-len(" changed")] if self.changed else text
+        self.code = compile(expression, "<condition>", "eval")
+
+    def evaluate(self, computer):
+        return eval(self.code, {"__builtins__": {}}, namespace(computer))
+
+
+@dataclass
+class Breakpoint:
+    line: int
+    condition: Condition | None = None
+    # for "changed" conditions, the value seen the last time the line was reached
+    last: Any = None
+
+    def test(self, computer) -> bool:
+        if self.condition is None:
+            return True
+        value = self.condition.evaluate(computer)
+        if not self.condition.changed:
+            return bool(value)
+        changed = self.last is not None and value != self.last
+        self.last = value
+        return changed
+
+
+@dataclass
+class Watchpoint:
+    kind: str  # "cache", "ram", "register" or "screen"
+    index: int | str | None = None
+    condition: Condition | None = None
+
+    def writes(self, command) -> bool:
+        name, arg = command.name, command.arg
+        if self.kind == "cache":
+            return name == "SVA" and arg == self.index
+        if self.kind == "ram":
+            return name == "RW"
+        if self.kind == "screen":
+            return name == "SVA" and arg is not None and arg // 32 and arg % 32 == 6
+        return name in REGISTER_WRITERS[self.index]
+
+    def prepare(self, computer) -> Any:
+        if self.kind == "ram":
+            state = computer.state
+            if state.loaded_bank_index * 16 + state.b % 16 != self.index:
+                return None
+        if self.condition is not None and self.condition.changed:
+            return self.condition.evaluate(computer)
+        return True
+
+    def fired(self, computer, before: Any) -> bool:
+        if before is None:
+            return False
+        if self.condition is None:
+            return True
+        if self.condition.changed:
+            return self.condition.evaluate(computer) != before
+        return bool(self.condition.evaluate(computer))
+
+
+def parse_condition(text: str | None) -> Condition | None:
+    return Condition(text) if text else None
+
+
+def parse_breakpoint(text: str) -> Breakpoint:
+    # "LINE[:CONDITION]"
+    line, _, condition = text.partition(":")
+    return Breakpoint(int(line), parse_condition(condition))
+
+
+def parse_watchpoint(text: str) -> Watchpoint:
+    # "cache[4]", "ram[100]", "A", "screen", each optionally ":CONDITION"
+    target, _, condition = text.partition(":")
+    target = target.strip()
+    if target.upper() in ("A", "B", "C"):
+        return Watchpoint("register", target.lower(), parse_condition(condition))
+    if target == "screen":
+        return Watchpoint("screen", None, parse_condition(condition))
+    kind, _, index = target.partition("[")
+    if kind not in ("cache", "ram") or not index.endswith("]"):
+        raise ValueError(f"Unknown watch target {target!r}")
+    return Watchpoint(kind, int(index[:-1]), parse_condition(condition))
+
+
+@dataclass
+class Breakpoints:
+    breakpoints: list[Breakpoint] = field(default_factory=list)
+    watchpoints: list[Watchpoint] = field(default_factory=list)
+    # per address lookup tables built by compile()
+    lines: list[Breakpoint | None] = field(default_factory=list)
+    watches: list[list[Watchpoint] | None] = field(default_factory=list)
+    hit: Breakpoint | Watchpoint | None = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.breakpoints or self.watchpoints)
+
+    def stops(self) -> set[int]:
+        return ({address for address, line in enumerate(self.lines) if line is not None}
+                | {address for address, watches in enumerate(self.watches) if watches is not None})
+
+    def compile(self, program: list) -> None:
+        self.lines = [None] * len(program)
+        for breakpoint in self.breakpoints:
+            if 0 <= breakpoint.line < len(program):
+                self.lines[breakpoint.line] = breakpoint
+        if not self.watchpoints:
+            self.watches = [None] * len(program)
+            return
+        self.watches = [[watch for watch in self.watchpoints if watch.writes(command)] or None
+                        for command in program]
+
+    def move_lines(self, idx: int, delta: int):
+        # breakpoints follow their lines when line idx is inserted (delta 1)
+        # or deleted (delta -1), the ones on a deleted line go with it
+        if delta < 0:
+            self.breakpoints = [breakpoint for breakpoint in self.breakpoints if breakpoint.line != idx]
+        for breakpoint in self.breakpoints:
+            breakpoint.line = moved_address(breakpoint.line, idx, delta)
+
+    def swap_lines(self, first: int, second: int):
+        swapped = {first: second, second: first}
+        for breakpoint in self.breakpoints:
+            breakpoint.line = swapped.get(breakpoint.line, breakpoint.line)
+
+    def toggle_line(self, line: int):
+        for breakpoint in self.breakpoints:
+            if breakpoint.line == line:
+                self.breakpoints.remove(breakpoint)
+                return
+        self.breakpoints.append(Breakpoint(line))
+
+    def toggle_watch(self, kind: str, index: int | str | None):
+        for watch in self.watchpoints:
+            if watch.kind == kind and watch.index == index and watch.condition is None:
+                self.watchpoints.remove(watch)
+                return
+        self.watchpoints.append(Watchpoint(kind, index))
@@ -1,109 +1,506 @@
-from ctypes import c_int16
 from dataclasses import dataclass, field
-from typing import Sequence
-from random import randint
+from typing import Callable, Sequence
 
 import numpy as np
 
+from breakpoints import Breakpoints
+from input_stream import InputProvider, RandomInput
+from journal import CACHE, Journal
+from output_log import OutputLog
+from profiler import Profile
+from program import ARG_COMMANDS, NO_ARG, NO_ARG_COMMANDS, Command, Opcode, Program, as_program, moved_address
+from snapshot import BANK_COUNT, BANK_SIZE, Snapshot, frozen_copy, share_banks
+from timing import TimingModel
 
-@dataclass(init=False)
-class Command:
-    name: str
-    arg: int | None
 
-    def __init__(self, init_string: str):
-        if init_string == "":
-            self.name = ""
-            self.arg = None
-            return
-        parts = init_string.split()
-        self.name = parts[0]
-        if len(parts) > 1:
-            if parts[1].isdecimal():
-                self.arg = int(parts[1])
-            else:
-                self.arg = 0
-        else:
-            self.arg = None
+def wrap16(value: int) -> int:
+    return (int(value) + 0x8000 & 0xFFFF) - 0x8000
 
-    def is_input(self):
-        return (self.name == "LA" or self.name == "LB") and self.arg // 32
 
-    def repr(self):
-        if self.arg is not None:
-            return f"{self.name} {self.arg}"
-        return self.name
+class RegisterFile:
+    # A, B and C as plain signed 16 bit ints, every write has to wrap around
+    # like the hardware does
+    __slots__ = ("a", "b", "c")
+
+    def __init__(self, a: int = 0, b: int = 0, c: int = 0):
+        self.a = a
+        self.b = b
+        self.c = c
+
+    def __repr__(self):
+        return f"RegisterFile(a={self.a}, b={self.b}, c={self.c})"
 
 
 @dataclass
 class State:
-    program_data: Sequence[Command]
+    program_data: Program
     instruction_pointer: int = 0
     clock_cycle: int = 0
-    _a = c_int16(0)
-    _b = c_int16(0)
-    _c = c_int16(0)
+    # in-game time according to the Computer's timing model
+    ticks: int = 0
+    registers: RegisterFile = field(default_factory=RegisterFile)
     cache_slots: Sequence[np.int16] = field(default_factory=lambda: np.zeros(32, np.int16))
-    ram: Sequence[np.int16] = field(default_factory=lambda: np.zeros(1024, np.int16))
-    loaded_bank: Sequence[np.int16] = field(default_factory=lambda: np.zeros(16, np.int16))
+    ram: Sequence[np.int16] = field(default_factory=lambda: np.zeros(BANK_COUNT * BANK_SIZE, np.int16))
+    # RR/RW address ram directly at the bank offset, RC only moves the offset
     loaded_bank_index: int = 0
     running: bool = True
     inputs: Sequence[np.int16] = field(default_factory=lambda: np.zeros(8, np.int16))
+    screen_position: tuple[int, int] | None = None
+
+    @property
+    def loaded_bank(self) -> np.ndarray:
+        start = self.loaded_bank_index * BANK_SIZE
+        return self.ram[start:start + BANK_SIZE]
 
     @property
     def a(self) -> int:
-        return self._a.value
+        return self.registers.a
 
     @a.setter
     def a(self, value: int):
-        self._a.value = value
+        self.registers.a = wrap16(value)
 
     @property
     def b(self) -> int:
-        return self._b.value
+        return self.registers.b
 
     @b.setter
     def b(self, value: int):
-        self._b.value = value
-        
+        self.registers.b = wrap16(value)
+
     @property
     def c(self) -> int:
-        return self._c.value
-    
+        return self.registers.c
+
     @c.setter
     def c(self, value: int):
-        self._c.value = value
+        self.registers.c = wrap16(value)
+
+
+# Commands with a missing argument decode to EXECUTE, which defers to
+# Computer.execute so both engines fail the same way.
+def decode(command: Command) -> tuple[Opcode, int]:
+    name, arg = command.name, command.arg
+    if name not in NO_ARG_COMMANDS and name not in ARG_COMMANDS:
+        return Opcode.NOP, 0
+    if arg is None and name not in NO_ARG_COMMANDS:
+        return Opcode.EXECUTE, 0
+    if name in NO_ARG_COMMANDS:
+        return Opcode[name], 0
+    if command.is_input():
+        return (Opcode.LA_INPUT if name == "LA" else Opcode.LB_INPUT), arg % 32
+    if name == "SVA" and arg // 32:
+        return Opcode.SVA_OUTPUT, arg % 32
+    return Opcode[name], arg
+
+
+def decode_program(program: Program) -> tuple[list[int], list[int]]:
+    # decode() for every line at once, looked up per name code and then fixed
+    # up per line for missing args, input reads and output writes
+    names = program.names
+    known = np.array([name in NO_ARG_COMMANDS or name in ARG_COMMANDS for name in names])
+    no_arg = np.array([name in NO_ARG_COMMANDS for name in names])
+    base = np.array([Opcode[name] if name in NO_ARG_COMMANDS or name in ARG_COMMANDS else Opcode.NOP
+                     for name in names], np.int64)
+    codes, args = program.codes, program.args
+    opcodes = base[codes]
+    operands = np.where(known[codes] & ~no_arg[codes], args, 0)
+    missing = known[codes] & ~no_arg[codes] & (args == NO_ARG)
+    opcodes[missing] = Opcode.EXECUTE
+    operands[missing] = 0
+    for name, opcode in (("LA", Opcode.LA_INPUT), ("LB", Opcode.LB_INPUT), ("SVA", Opcode.SVA_OUTPUT)):
+        lines = (codes == program.name_codes.get(name, -1)) & (args >= 32)
+        opcodes[lines] = opcode
+        operands[lines] %= 32
+    return opcodes.tolist(), operands.tolist()
+
+
+JUMP_OPCODES = {Opcode.JMP, Opcode.JE, Opcode.JNE, Opcode.JG, Opcode.JL, Opcode.JGE, Opcode.JLE}
+MAX_BLOCK_LENGTH = 256
+
+WRAP = " + 0x8000 & 0xFFFF) - 0x8000"
+BLOCK_TEMPLATES = {
+    Opcode.NOP: None,
+    Opcode.LA: "r.a = int(cache[{arg}])",
+    Opcode.LB: "r.b = int(cache[{arg}])",
+    Opcode.LAL: "r.a = {arg} & 255",
+    Opcode.LAH: "r.a = ((r.a | {arg} << 8)" + WRAP,
+    Opcode.LBL: "r.b = {arg} & 255",
+    Opcode.LBH: "r.b = ((r.b | {arg} << 8)" + WRAP,
+    Opcode.LCL: "r.c = {arg} & 255",
+    Opcode.SVA: "cache[{arg}] = r.a",
+    Opcode.STP: "state.running = False",
+    Opcode.ADD: "r.a = (r.a + r.b" + WRAP,
+    Opcode.SUB: "r.a = (r.a - r.b" + WRAP,
+    Opcode.AND: "r.a &= r.b",
+    Opcode.OR: "r.a |= r.b",
+    Opcode.XOR: "r.a ^= r.b",
+    Opcode.SUP: "r.a = ((r.a << {arg})" + WRAP,
+    Opcode.SDN: "r.a >>= {arg}",
+    Opcode.MUL: "r.a = (r.a * r.b" + WRAP,
+    Opcode.INB: "r.b = (r.b + 1" + WRAP,
+    Opcode.RW: "state.ram[(state.loaded_bank_index << 4) + (r.b & 15)] = r.a",
+    Opcode.RR: "r.a = int(state.ram[(state.loaded_bank_index << 4) + (r.b & 15)])",
+    Opcode.RC: "switch_bank((r.b >> 4) & 63)",
+}
+JUMP_CONDITIONS = {
+    Opcode.JE: "==", Opcode.JNE: "!=", Opcode.JG: ">", Opcode.JL: "<", Opcode.JGE: ">=", Opcode.JLE: "<=",
+}
+
+
+class Block:
+    __slots__ = ("function", "length")
+
+    def __init__(self, function: Callable[["State"], int], length: int):
+        self.function = function
+        self.length = length
+
+
+class BlockCompiler:
+    # Compiles the straight-line run of instructions starting at an address
+    # into a single Python function that returns the next instruction pointer.
+    # A block ends after a jump or STP and before jump targets, so it is a
+    # basic block when entered at its leader. Input reads, output writes and
+    # anything decoded to EXECUTE are left to Computer.step.
+    def __init__(self, computer: "Computer"):
+        self.computer = computer
+        self.namespace = {"switch_bank": computer.switch_bank}
+        # addresses with breakpoints or watched writes, blocks stop before them
+        self.barriers: set[int] = set()
+        self.invalidate()
 
+    def invalidate(self, barriers: set[int] | None = None):
+        self.blocks: dict[int, Block | None] = {}
+        self.leaders: set[int] | None = None
+        if barriers is not None:
+            self.barriers = barriers
 
-NON_COMMAND = Command("NON")
+    def get(self, ip: int) -> Block | None:
+        try:
+            return self.blocks[ip]
+        except KeyError:
+            block = self.blocks[ip] = self.compile(ip)
+            return block
+
+    def find_leaders(self) -> set[int]:
+        computer = self.computer
+        return {operand for opcode, operand in zip(computer.opcodes, computer.operands) if opcode in JUMP_OPCODES}
+
+    def compile(self, start: int) -> Block | None:
+        if self.leaders is None:
+            self.leaders = self.find_leaders()
+        opcodes, operands = self.computer.opcodes, self.computer.operands
+        lines = []
+        terminator = []
+        ip = start
+        while ip < len(opcodes) and ip - start < MAX_BLOCK_LENGTH:
+            if ip != start and (ip in self.leaders or ip in self.barriers):
+                break
+            opcode, arg = opcodes[ip], operands[ip]
+            if opcode in JUMP_OPCODES:
+                condition = JUMP_CONDITIONS.get(opcode)
+                if condition is None:
+                    terminator.append(f"return {arg}")
+                else:
+                    terminator.append(f"if r.a {condition} r.b: return {arg}")
+                ip += 1
+                break
+            if opcode not in BLOCK_TEMPLATES:
+                break
+            template = BLOCK_TEMPLATES[opcode]
+            if template is not None:
+                lines.append(template.format(arg=arg))
+            ip += 1
+            if opcode == Opcode.STP:
+                break
+
+        length = ip - start
+        if length == 0:
+            return None
+        source = "\n    ".join([
+            f"def block_{start}(state):",
+            "r = state.registers",
+            "cache = state.cache_slots",
+            *lines,
+            f"state.clock_cycle += {length}",
+            f"state.ticks += {sum(self.computer.costs[start:ip])}",
+            *terminator,
+            f"return {ip}",
+        ])
+        code = compile(source, f"<block {start}-{ip - 1}>", "exec")
+        exec(code, self.namespace)
+        return Block(self.namespace.pop(f"block_{start}"), length)
 
 
 class Computer:
-    def __init__(self, program_data: str):
-        program = [Command(line) for line in program_data.split("\n")]
+    def __init__(self, program_data: str | Program, compiled: bool = True, output: OutputLog | None = None,
+                 blocks: bool = False, timing: TimingModel | None = None,
+                 input_provider: InputProvider | None = None):
+        program = as_program(program_data)
         self.state = State(program)
-        self.output: Sequence[tuple[int, int]] = []
+        self.output = output if output is not None else OutputLog()
+        self.input_provider = input_provider if input_provider is not None else RandomInput()
         self.screen: Sequence[Sequence[int]] = np.zeros((64, 64), bool)
         self.screenbuffer: Sequence[Sequence[int]] = np.zeros((64, 64), bool)
 
+        self.compiled = compiled
+        self.handlers: list[Callable[[int], None]] = [
+            getattr(self, f"_op_{opcode.name.lower()}") for opcode in Opcode]
+        self.opcodes: list[int] = []
+        self.operands: list[int] = []
+        self.blocks = BlockCompiler(self) if blocks else None
+        self.breakpoints: Breakpoints | None = None
+        self.profile: Profile | None = None
+        self.timing = timing if timing is not None else TimingModel()
+        self.costs: list[int] = []
+        self.last_snapshot: Snapshot | None = None
+        self.journal: Journal | None = None
+        self.load_program(program)
+
+    def load_program(self, program: Program):
+        self.state.program_data = program
+        self.opcodes, self.operands = decode_program(program)
+        self.program_changed()
+
+    def set_line(self, idx: int, command: Command):
+        self.state.program_data[idx] = command
+        self.opcodes[idx], self.operands[idx] = decode(command)
+        self.program_changed()
+
+    # inserting, deleting and swapping lines retargets jumps in the program,
+    # so it is decoded again as a whole. The IP and breakpoints stay on the
+    # lines they were on.
+
+    def insert_line(self, idx: int, command: Command):
+        self.state.program_data.insert(idx, command)
+        self.move_lines(idx, 1)
+
+    def delete_line(self, idx: int):
+        del self.state.program_data[idx]
+        self.move_lines(idx, -1)
+
+    def move_lines(self, idx: int, delta: int):
+        state = self.state
+        state.instruction_pointer = moved_address(state.instruction_pointer, idx, delta)
+        if self.breakpoints is not None:
+            self.breakpoints.move_lines(idx, delta)
+        self.load_program(state.program_data)
+
+    def swap_lines(self, first: int, second: int):
+        self.state.program_data.swap(first, second)
+        if self.breakpoints is not None:
+            self.breakpoints.swap_lines(first, second)
+        self.load_program(self.state.program_data)
+
+    def program_changed(self):
+        self.costs = self.timing.costs(self.state.program_data)
+        # the history refers to lines of the old program
+        if self.journal is not None:
+            self.journal.reset()
+        # counts of the old program don't map onto the new one
+        if self.profile is not None:
+            self.start_profile()
+        self.breakpoints_changed()
+
+    def set_timing(self, timing: TimingModel):
+        self.timing = timing
+        self.program_changed()
+
+    def breakpoints_changed(self):
+        if self.breakpoints is not None:
+            self.breakpoints.compile(self.state.program_data)
+        if self.blocks is not None:
+            self.blocks.invalidate(self.breakpoints.stops() if self.breakpoints is not None else set())
+
+    def set_breakpoints(self, breakpoints: Breakpoints | None):
+        # call again after changing the breakpoints to rebuild the lookup tables
+        self.breakpoints = breakpoints
+        self.breakpoints_changed()
+
+    def start_profile(self) -> Profile:
+        self.profile = Profile(len(self.opcodes))
+        return self.profile
+
+    def stop_profile(self) -> Profile | None:
+        profile, self.profile = self.profile, None
+        return profile
+
+    def snapshot(self) -> Snapshot:
+        state = self.state
+        previous = self.last_snapshot
+        banks = list(state.ram.reshape(BANK_COUNT, BANK_SIZE))
+        self.last_snapshot = Snapshot(
+            instruction_pointer=state.instruction_pointer,
+            clock_cycle=state.clock_cycle,
+            ticks=state.ticks,
+            registers=(state.a, state.b, state.c),
+            running=state.running,
+            loaded_bank_index=state.loaded_bank_index,
+            screen_position=state.screen_position,
+            cache_slots=frozen_copy(state.cache_slots, previous and previous.cache_slots),
+            ram_banks=share_banks(banks, previous),
+            inputs=frozen_copy(state.inputs, previous and previous.inputs),
+            screen=frozen_copy(self.screen, previous and previous.screen),
+            screenbuffer=frozen_copy(self.screenbuffer, previous and previous.screenbuffer),
+        )
+        return self.last_snapshot
+
+    def restore(self, snapshot: Snapshot):
+        state = self.state
+        state.instruction_pointer = snapshot.instruction_pointer
+        state.clock_cycle = snapshot.clock_cycle
+        state.ticks = snapshot.ticks
+        state.registers = RegisterFile(*snapshot.registers)
+        state.running = snapshot.running
+        state.screen_position = snapshot.screen_position
+        state.cache_slots = snapshot.cache_slots.copy()
+        state.ram = snapshot.ram()
+        state.loaded_bank_index = snapshot.loaded_bank_index
+        state.inputs = snapshot.inputs.copy()
+        self.screen = snapshot.screen.copy()
+        self.screenbuffer = snapshot.screenbuffer.copy()
+        self.last_snapshot = snapshot
+
     def step(self):
-        command = self.state.program_data[self.state.instruction_pointer]
-        self.state.instruction_pointer += 1
-        self.execute(command)
-        self.state.clock_cycle += 1
-        if self.state.instruction_pointer >= len(self.state.program_data):
-            self.state.running = False
-            return NON_COMMAND
-        return self.state.program_data[self.state.instruction_pointer]
+        state = self.state
+        ip = state.instruction_pointer
+        if self.journal is not None:
+            self.journal.record(self, self.opcodes[ip], self.operands[ip])
+        state.instruction_pointer = ip + 1
+        if self.compiled:
+            self.handlers[self.opcodes[ip]](self.operands[ip])
+        else:
+            self.execute(state.program_data[ip])
+        state.clock_cycle += 1
+        state.ticks += self.costs[ip]
+        if self.profile is not None:
+            self.profile.count_step(ip, state.instruction_pointer)
+        if state.instruction_pointer >= len(self.opcodes):
+            state.running = False
+
+    def step_back(self) -> tuple | bool:
+        # returns the undone change (None if the step only touched registers),
+        # or False when there is no history left
+        if self.journal is None or self.state.clock_cycle == 0:
+            return False
+        if not self.journal.entries and not self.journal.rebuild(self):
+            return False
+        return self.journal.undo(self)
+
+    def run_back_to_cache_write(self, slot: int) -> bool:
+        while True:
+            change = self.step_back()
+            if change is False:
+                return False
+            if change is not None and change[0] == CACHE and change[1] == slot:
+                return True
+
+    def run(self, max_steps: int, pause_on_input: bool = False) -> int:
+        if self.breakpoints is not None and self.breakpoints.active:
+            return self.run_checked(max_steps, pause_on_input)
+        if self.blocks is not None and self.journal is None:
+            return self.run_blocks(max_steps, pause_on_input)
+        state = self.state
+        step = self.step
+        if not pause_on_input:
+            for executed in range(max_steps):
+                if not state.running:
+                    return executed
+                step()
+            return max_steps
+
+        for executed in range(max_steps):
+            if not state.running:
+                return executed
+            step()
+            if state.running and state.program_data[state.instruction_pointer].is_input():
+                return executed + 1
+        return max_steps
+
+    def run_blocks(self, max_steps: int, pause_on_input: bool) -> int:
+        # blocks only run when they fit into the remaining budget, everything
+        # else goes through step so the run ends on an exact instruction
+        state = self.state
+        blocks = self.blocks
+        profile = self.profile
+        program_length = len(self.opcodes)
+        executed = 0
+        while executed < max_steps and state.running:
+            ip = state.instruction_pointer
+            block = blocks.get(ip)
+            if block is None or block.length > max_steps - executed:
+                self.step()
+                executed += 1
+            else:
+                state.instruction_pointer = block.function(state)
+                executed += block.length
+                if profile is not None:
+                    profile.count_block(ip, block.length, state.instruction_pointer)
+                if state.instruction_pointer >= program_length:
+                    state.running = False
+            if pause_on_input and state.running and state.program_data[state.instruction_pointer].is_input():
+                break
+        return executed
+
+    def run_checked(self, max_steps: int, pause_on_input: bool) -> int:
+        # Like run_blocks, but stops on breakpoints and watchpoints. Only the
+        # addresses flagged in the breakpoint tables pay for any checks.
+        state = self.state
+        breakpoints = self.breakpoints
+        breakpoints.hit = None
+        lines, watch_table = breakpoints.lines, breakpoints.watches
+        blocks = self.blocks if self.journal is None else None
+        program_length = len(self.opcodes)
+        executed = 0
+        while executed < max_steps and state.running:
+            ip = state.instruction_pointer
+            watches = watch_table[ip]
+            block = blocks.get(ip) if blocks is not None and watches is None else None
+            if block is not None and block.length <= max_steps - executed:
+                state.instruction_pointer = block.function(state)
+                executed += block.length
+                if self.profile is not None:
+                    self.profile.count_block(ip, block.length, state.instruction_pointer)
+                if state.instruction_pointer >= program_length:
+                    state.running = False
+            elif watches is None:
+                self.step()
+                executed += 1
+            else:
+                before = [watch.prepare(self) for watch in watches]
+                self.step()
+                executed += 1
+                for watch, context in zip(watches, before):
+                    if watch.fired(self, context):
+                        breakpoints.hit = watch
+                        return executed
+
+            if not state.running:
+                break
+            line = lines[state.instruction_pointer]
+            if line is not None and line.test(self):
+                breakpoints.hit = line
+                break
+            if pause_on_input and state.program_data[state.instruction_pointer].is_input():
+                break
+        return executed
+
+    def read_input(self, slot: int) -> int:
+        # the inputs keep what the provider returned, so the UI, snapshots
+        # and the journal see the value that was read
+        state = self.state
+        value = self.input_provider.read(slot, state.clock_cycle, state.inputs)
+        state.inputs[slot] = value
+        if self.journal is not None:
+            self.journal.read_input(state.clock_cycle, slot, value)
+        return value
 
     def execute(self, command: Command):
-        if command.arg == 39:
-            self.state.inputs[7] = randint(-32768, 32767)
         if command.is_input():
             if command.name == "LA":
-                self.state.a = self.state.inputs[command.arg % 32]
+                self.state.a = self.read_input(command.arg % 32)
             else:
-                self.state.b = self.state.inputs[command.arg % 32]
+                self.state.b = self.read_input(command.arg % 32)
             return
         match command.name:
             case "LA":
@@ -124,24 +521,7 @@ class Computer:
 
             case "SVA":
                 if command.arg // 32:
-                    print(self.state.a)
-                    register = command.arg % 32
-                    value = self.state.a
-                    self.output.append((register, value))
-                    if register == 6:
-                        x, y = self.find_last_screen_position()
-                        match value:
-                            case 1:
-                                self.screen[:] = self.screenbuffer[:]
-                            case 2:
-                                self.screenbuffer = np.zeros((64, 64), bool)
-                            case 4:
-                                self.screenbuffer[x][y] = True
-                            case 8:
-                                self.screenbuffer[x][y] = not self.screenbuffer[x][y]
-                            case 16:
-                                self.screenbuffer[x][y] = False
-
+                    self.write_output(command.arg % 32, self.state.a)
                 else:
                     self.state.cache_slots[command.arg] = self.state.a
 
@@ -169,16 +549,11 @@ class Computer:
                 self.state.b += 1
 
             case "RW":
-                self.state.loaded_bank[self.state.b % 16] = self.state.a
+                self.state.ram[self.state.loaded_bank_index * 16 + self.state.b % 16] = self.state.a
             case "RR":
-                self.state.a = self.state.loaded_bank[self.state.b % 16]
+                self.state.a = self.state.ram[self.state.loaded_bank_index * 16 + self.state.b % 16]
             case "RC":
-                bank = (self.state.b // 16) % 64
-                if bank != self.state.loaded_bank_index:
-                    self.state.ram[
-                    self.state.loaded_bank_index * 16:(self.state.loaded_bank_index + 1) * 16] = self.state.loaded_bank
-                    self.state.loaded_bank = self.state.ram[bank * 16:(bank + 1) * 16]
-                    self.state.loaded_bank_index = bank
+                self.switch_bank((self.state.b // 16) % 64)
 
             case "JMP":
                 self.state.instruction_pointer = command.arg
@@ -201,9 +576,153 @@ class Computer:
                 if self.state.a <= self.state.b:
                     self.state.instruction_pointer = command.arg
     
-    def find_last_screen_position(self):
-        for i in range(len(self.output) - 1, -1, -1):
-            if self.output[i][0] == 7:
-                value = self.output[i][1]
-                return (value & 0x3f, value >> 8 & 0x3f)
-        raise Exception("No screen position found")
+    def write_output(self, register: int, value: int):
+        self.output.write(register, value, self.state.clock_cycle)
+        if register == 7:
+            self.state.screen_position = (value & 0x3f, value >> 8 & 0x3f)
+        elif register == 6:
+            if self.state.screen_position is None:
+                raise Exception("No screen position found")
+            x, y = self.state.screen_position
+            match value:
+                case 1:
+                    self.screen[:] = self.screenbuffer[:]
+                case 2:
+                    self.screenbuffer = np.zeros((64, 64), bool)
+                case 4:
+                    self.screenbuffer[x][y] = True
+                case 8:
+                    self.screenbuffer[x][y] = not self.screenbuffer[x][y]
+                case 16:
+                    self.screenbuffer[x][y] = False
+
+    def switch_bank(self, bank: int):
+        if bank != self.state.loaded_bank_index:
+            self.state.loaded_bank_index = bank
+            if self.profile is not None:
+                self.profile.bank_switches[bank] += 1
+
+    def _op_nop(self, arg: int):
+        pass
+
+    def _op_execute(self, arg: int):
+        self.execute(self.state.program_data[self.state.instruction_pointer - 1])
+
+    # The handlers work on the register file directly and wrap inline, this is
+    # the hot path of the compiled engine.
+    def _op_la(self, arg: int):
+        self.state.registers.a = int(self.state.cache_slots[arg])
+
+    def _op_lb(self, arg: int):
+        self.state.registers.b = int(self.state.cache_slots[arg])
+
+    def _op_la_input(self, arg: int):
+        self.state.registers.a = self.read_input(arg)
+
+    def _op_lb_input(self, arg: int):
+        self.state.registers.b = self.read_input(arg)
+
+    def _op_lal(self, arg: int):
+        self.state.registers.a = arg & 255
+
+    def _op_lah(self, arg: int):
+        registers = self.state.registers
+        registers.a = ((registers.a | arg << 8) + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_lbl(self, arg: int):
+        self.state.registers.b = arg & 255
+
+    def _op_lbh(self, arg: int):
+        registers = self.state.registers
+        registers.b = ((registers.b | arg << 8) + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_lcl(self, arg: int):
+        self.state.registers.c = arg & 255
+
+    def _op_sva(self, arg: int):
+        self.state.cache_slots[arg] = self.state.registers.a
+
+    def _op_sva_output(self, arg: int):
+        self.write_output(arg, self.state.registers.a)
+
+    def _op_stp(self, arg: int):
+        self.state.running = False
+
+    def _op_add(self, arg: int):
+        registers = self.state.registers
+        registers.a = (registers.a + registers.b + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_sub(self, arg: int):
+        registers = self.state.registers
+        registers.a = (registers.a - registers.b + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_and(self, arg: int):
+        registers = self.state.registers
+        registers.a &= registers.b
+
+    def _op_or(self, arg: int):
+        registers = self.state.registers
+        registers.a |= registers.b
+
+    def _op_xor(self, arg: int):
+        registers = self.state.registers
+        registers.a ^= registers.b
+
+    def _op_sup(self, arg: int):
+        registers = self.state.registers
+        registers.a = ((registers.a << arg) + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_sdn(self, arg: int):
+        self.state.registers.a >>= arg
+
+    def _op_mul(self, arg: int):
+        registers = self.state.registers
+        registers.a = (registers.a * registers.b + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_inb(self, arg: int):
+        registers = self.state.registers
+        registers.b = (registers.b + 1 + 0x8000 & 0xFFFF) - 0x8000
+
+    def _op_rw(self, arg: int):
+        state = self.state
+        state.ram[(state.loaded_bank_index << 4) + (state.registers.b & 15)] = state.registers.a
+
+    def _op_rr(self, arg: int):
+        state = self.state
+        state.registers.a = int(state.ram[(state.loaded_bank_index << 4) + (state.registers.b & 15)])
+
+    def _op_rc(self, arg: int):
+        self.switch_bank((self.state.registers.b >> 4) & 63)
+
+    def _op_jmp(self, arg: int):
+        self.state.instruction_pointer = arg
+
+    def _op_je(self, arg: int):
+        registers = self.state.registers
+        if registers.a == registers.b:
+            self.state.instruction_pointer = arg
+
+    def _op_jne(self, arg: int):
+        registers = self.state.registers
+        if registers.a != registers.b:
+            self.state.instruction_pointer = arg
+
+    def _op_jg(self, arg: int):
+        registers = self.state.registers
+        if registers.a > registers.b:
+            self.state.instruction_pointer = arg
+
+    def _op_jl(self, arg: int):
+        registers = self.state.registers
+        if registers.a < registers.b:
+            self.state.instruction_pointer = arg
+
+    def _op_jge(self, arg: int):
+        registers = self.state.registers
+        if registers.a >= registers.b:
+            self.state.instruction_pointer = arg
+
+    def _op_jle(self, arg: int):
+        registers = self.state.registers
+        if registers.a <= registers.b:
+            self.state.instruction_pointer = arg
@@ -0,0 +1,198 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+
+from computer import Computer
+
+TURBO_BATCH = 4096
+# how often a running emulator publishes a new frame
+FRAME_INTERVAL = 1 / 120
+OUTPUT_TAIL = 9
+IDLE_WAIT = 0.05
+
+
+@dataclass(frozen=True)
+class Frame:
+    instruction_pointer: int
+    clock_cycle: int
+    ticks: int
+    running: bool
+    registers: tuple[int, int, int]
+    cache_slots: np.ndarray
+    loaded_bank_index: int
+    loaded_bank: np.ndarray
+    inputs: np.ndarray
+    # the newest output writes, newest last
+    output: tuple[tuple[int, int], ...]
+    screen: np.ndarray
+    screenbuffer: np.ndarray
+    auto_running: bool
+    hit: Any
+    line_counts: np.ndarray | None
+
+
+class Emulator:
+    # Owns the Computer and runs it on a worker thread. Everything that
+    # touches the machine goes through submit()/call() and runs on that thread
+    # between batches. The UI only reads the latest published Frame, which is
+    # replaced as a whole so it is always consistent.
+    def __init__(self, computer: Computer):
+        self.computer = computer
+        self.commands: queue.Queue[tuple[Future, Callable, tuple]] = queue.Queue()
+        # ("input", slot) when auto-run stopped in front of an input read,
+        # ("error", exception) when the program raised during auto-run
+        self.events: queue.Queue[tuple[str, Any]] = queue.Queue()
+        self.auto_running = False
+        self.turbo = False
+        self.pause_on_input = False
+        self.steps_per_second = 60
+        self.frame = self.make_frame()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def submit(self, function: Callable, *args) -> Future:
+        future = Future()
+        self.commands.put((future, function, args))
+        return future
+
+    def call(self, function: Callable, *args) -> Any:
+        return self.submit(function, *args).result()
+
+    def make_frame(self) -> Frame:
+        computer = self.computer
+        state = computer.state
+        breakpoints = computer.breakpoints
+        return Frame(
+            instruction_pointer=state.instruction_pointer,
+            clock_cycle=state.clock_cycle,
+            ticks=state.ticks,
+            running=state.running,
+            registers=(state.a, state.b, state.c),
+            cache_slots=state.cache_slots.copy(),
+            loaded_bank_index=state.loaded_bank_index,
+            loaded_bank=state.loaded_bank.copy(),
+            inputs=state.inputs.copy(),
+            output=tuple(computer.output[-i] for i in range(min(len(computer.output), OUTPUT_TAIL), 0, -1)),
+            screen=computer.screen.copy(),
+            screenbuffer=computer.screenbuffer.copy(),
+            auto_running=self.auto_running,
+            hit=breakpoints.hit if breakpoints is not None else None,
+            line_counts=computer.profile.line_counts() if computer.profile is not None else None,
+        )
+
+    def work(self):
+        published = time.perf_counter()
+        paced_from = published
+        paced_steps = 0
+        dirty = False
+        while True:
+            self.run_commands(block=not self.auto_running)
+            state = self.computer.state
+            if self.auto_running and not state.running:
+                self.auto_running = False
+
+            if self.auto_running:
+                if self.turbo:
+                    steps = TURBO_BATCH
+                else:
+                    # keep the configured rate no matter how fast frames are drawn
+                    now = time.perf_counter()
+                    if paced_steps == 0:
+                        paced_from = now
+                    steps = int((now - paced_from) * self.steps_per_second) + 1 - paced_steps
+                    if steps <= 0:
+                        time.sleep(min(1 / self.steps_per_second, IDLE_WAIT))
+                        steps = 0
+                if steps:
+                    try:
+                        executed = self.computer.run(steps, self.pause_on_input)
+                    except Exception as e:
+                        # the worker has to survive a faulty program, the
+                        # machine stays where it failed
+                        self.auto_running = False
+                        self.frame = self.make_frame()
+                        dirty = False
+                        self.events.put(("error", e))
+                        continue
+                    paced_steps += executed
+                    dirty = True
+                    input_slot = self.check_stop(executed)
+                    if input_slot is not None:
+                        # publish first so the UI sees the machine stopped at the input
+                        self.frame = self.make_frame()
+                        dirty = False
+                        self.events.put(("input", input_slot))
+            else:
+                paced_steps = 0
+
+            now = time.perf_counter()
+            if dirty and (now - published >= FRAME_INTERVAL or not self.auto_running):
+                self.frame = self.make_frame()
+                published = now
+                dirty = False
+
+    def run_commands(self, block: bool):
+        ran = False
+        while True:
+            try:
+                future, function, args = self.commands.get(block and not ran, IDLE_WAIT)
+            except queue.Empty:
+                return
+            ran = True
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args)
+            except Exception as e:
+                self.frame = self.make_frame()
+                future.set_exception(e)
+            else:
+                # the frame is current by the time call() returns
+                self.frame = self.make_frame()
+                future.set_result(result)
+
+    def check_stop(self, executed: int) -> int | None:
+        # stops auto-run on a breakpoint hit or in front of an input read with
+        # pause on input, returns the input slot for the latter
+        computer = self.computer
+        state = computer.state
+        if computer.breakpoints is not None and computer.breakpoints.hit is not None:
+            self.auto_running = False
+        if executed and self.pause_on_input and state.running:
+            command = state.program_data[state.instruction_pointer]
+            if command.is_input():
+                self.auto_running = False
+                return command.arg % 32
+        return None
+
+    # commands, run on the worker thread through submit()/call()
+
+    def set_auto_running(self, auto_running: bool):
+        self.auto_running = auto_running and self.computer.state.running
+
+    def toggle_auto_running(self):
+        self.set_auto_running(not self.auto_running)
+
+    def step(self):
+        if self.computer.state.running:
+            self.auto_running = False
+            if self.computer.breakpoints is not None:
+                self.computer.breakpoints.hit = None
+            self.computer.step()
+
+    def step_back(self, cache_slot: int | None = None):
+        self.auto_running = False
+        if self.computer.breakpoints is not None:
+            self.computer.breakpoints.hit = None
+        if cache_slot is not None:
+            self.computer.run_back_to_cache_write(cache_slot)
+        else:
+            self.computer.step_back()
+
+    def set_input(self, slot: int, value: int):
+        self.computer.state.inputs[slot] = value
@@ -0,0 +1,161 @@
+import argparse
+import json
+import sys
+import time
+
+from breakpoints import Breakpoint, Breakpoints, parse_breakpoint, parse_watchpoint
+from computer import Computer
+from input_stream import DEFAULT_SEED, RandomInput, Recorder, Replay, ReplayError
+from output_log import BinarySink, NDJSONSink, OutputLog, DEFAULT_CAPACITY
+from preprocessor import load_program
+from timing import TimingModel
+
+CHUNK_SIZE = 100_000
+
+
+def parse_input(text: str) -> tuple[int, int, int]:
+    # "[CYCLE:]SLOT=VALUE", inputs without a cycle are set before the first step
+    cycle, _, assignment = text.rpartition(":")
+    slot, _, value = assignment.partition("=")
+    return int(cycle or 0), int(slot), int(value)
+
+
+def dump_state(computer: Computer) -> dict:
+    state = computer.state
+    return {
+        "registers": {"a": state.a, "b": state.b, "c": state.c},
+        "instruction_pointer": state.instruction_pointer,
+        "clock_cycle": state.clock_cycle,
+        "ticks": state.ticks,
+        "running": state.running,
+        "cache": state.cache_slots.tolist(),
+        "loaded_bank_index": state.loaded_bank_index,
+        "ram": state.ram.tolist(),
+        "inputs": state.inputs.tolist(),
+        "screen_position": state.screen_position,
+        "output": [[register, int(value)] for register, value in computer.output],
+        "output_count": computer.output.count,
+        "screen": ["".join("1" if lamp else "0" for lamp in row) for row in computer.screen],
+    }
+
+
+def describe_hit(computer: Computer) -> dict | None:
+    if computer.breakpoints is None or computer.breakpoints.hit is None:
+        return None
+    hit = computer.breakpoints.hit
+    condition = hit.condition.text if hit.condition is not None else None
+    if isinstance(hit, Breakpoint):
+        return {"type": "breakpoint", "line": hit.line, "condition": condition}
+    return {"type": "watchpoint", "kind": hit.kind, "index": hit.index, "condition": condition}
+
+
+def run(computer: Computer, max_cycles: int | None, inputs: list[tuple[int, int, int]]) -> float:
+    schedule = sorted(inputs)
+    start = time.perf_counter()
+    while computer.state.running:
+        while schedule and schedule[0][0] <= computer.state.clock_cycle:
+            _, slot, value = schedule.pop(0)
+            computer.state.inputs[slot] = value
+
+        limit = CHUNK_SIZE
+        if schedule:
+            limit = min(limit, schedule[0][0] - computer.state.clock_cycle)
+        if max_cycles is not None:
+            limit = min(limit, max_cycles - computer.state.clock_cycle)
+            if limit <= 0:
+                break
+        computer.run(limit)
+        if computer.breakpoints is not None and computer.breakpoints.hit is not None:
+            break
+    return time.perf_counter() - start
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run a redstone program without the debugger UI.")
+    parser.add_argument("program", help="code.txt or .skript source file")
+    parser.add_argument("-n", "--cycles", type=int, default=None,
+                        help="cycle budget, runs until STP or the end of the program if omitted")
+    parser.add_argument("-i", "--input", action="append", default=[], type=parse_input,
+                        metavar="[CYCLE:]SLOT=VALUE", help="set an input slot, optionally at a given cycle")
+    parser.add_argument("-o", "--output", default="-", help="JSON result file, stdout by default")
+    parser.add_argument("--output-capacity", type=int, default=DEFAULT_CAPACITY,
+                        help="number of output writes kept in the result")
+    parser.add_argument("--stream", help="stream every output write to this file")
+    parser.add_argument("--stream-format", choices=("ndjson", "binary"), default="ndjson")
+    parser.add_argument("--echo", action="store_true",
+                        help="print output writes to the console, to stderr if the result goes to stdout")
+    parser.add_argument("--break", dest="breakpoints", action="append", default=[], type=parse_breakpoint,
+                        metavar="LINE[:CONDITION]", help="stop before a line, optionally only when CONDITION holds")
+    parser.add_argument("--watch", action="append", default=[], type=parse_watchpoint,
+                        metavar="TARGET[:CONDITION]",
+                        help="stop after a write to cache[N], ram[N], A, B, C or screen, "
+                             "CONDITION may end in 'changed'")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write per-line counts, jump, cache and bank statistics as JSON")
+    parser.add_argument("--timing", metavar="FILE",
+                        help="tick cost table like timing.json, every instruction costs one tick without it")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="seed for the random values of input 7")
+    parser.add_argument("--record", metavar="FILE", help="record every input read with its cycle")
+    parser.add_argument("--replay", metavar="FILE", help="answer input reads from a recording")
+    args = parser.parse_args(argv)
+
+    sink = None
+    if args.stream is not None:
+        if args.stream_format == "binary":
+            sink = BinarySink(open(args.stream, "wb"))
+        else:
+            sink = NDJSONSink(open(args.stream, "w"))
+    # keep the JSON result on stdout clean
+    output = OutputLog(args.output_capacity, sink, args.echo, sys.stderr if args.output == "-" else None)
+
+    timing = TimingModel.load(args.timing) if args.timing is not None else None
+    if args.replay is not None:
+        with open(args.replay, "rb") as f:
+            inputs = Replay.load(f)
+    else:
+        inputs = RandomInput(args.seed)
+    if args.record is not None:
+        inputs = Recorder(inputs)
+    computer = Computer(load_program(args.program), output=output, blocks=True, timing=timing,
+                        input_provider=inputs)
+    if args.breakpoints or args.watch:
+        computer.set_breakpoints(Breakpoints(args.breakpoints, args.watch))
+    if args.profile is not None:
+        computer.start_profile()
+    error = None
+    start = time.perf_counter()
+    try:
+        elapsed = run(computer, args.cycles, args.input)
+    except ReplayError as e:
+        # the recording ran out or was made with another program
+        elapsed = time.perf_counter() - start
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        output.close()
+        if sink is not None:
+            sink.file.close()
+        if args.record is not None:
+            with open(args.record, "wb") as f:
+                inputs.save(f)
+
+    result = dump_state(computer)
+    result["stopped_at"] = describe_hit(computer)
+    result["error"] = error
+    result["timing"] = computer.timing.report(computer.state.clock_cycle, computer.state.ticks)
+    result["elapsed"] = elapsed
+    result["instructions_per_second"] = computer.state.clock_cycle / elapsed if elapsed else 0.0
+
+    if args.profile is not None:
+        with open(args.profile, "w") as f:
+            json.dump(computer.profile.report(computer.state.program_data), f)
+
+    if args.output == "-":
+        json.dump(result, sys.stdout)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
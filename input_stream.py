@@ -0,0 +1,95 @@
+from typing import BinaryIO
+
+import numpy as np
+
+from output_log import RECORD
+
+# reads of input 7 see a fresh random value
+RANDOM_SLOT = 7
+RANDOM_BATCH = 4096
+DEFAULT_SEED = 0
+
+
+def rewind(reads, cycle: int):
+    # drops the (cycle, slot, value) reads at and after cycle
+    while reads and reads[-1][0] >= cycle:
+        reads.pop()
+
+
+class InputProvider:
+    # Decides what a program sees when it reads an input slot. The plain
+    # provider returns the value set in the inputs.
+    def read(self, slot: int, cycle: int, inputs: np.ndarray) -> int:
+        return int(inputs[slot])
+
+
+class RandomInput(InputProvider):
+    # input 7 values come from a seeded generator, drawn in batches so a read
+    # is a list lookup
+    def __init__(self, seed: int | None = None, batch_size: int = RANDOM_BATCH):
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.values: list[int] = []
+        self.position = 0
+
+    def read(self, slot: int, cycle: int, inputs: np.ndarray) -> int:
+        if slot != RANDOM_SLOT:
+            return int(inputs[slot])
+        if self.position == len(self.values):
+            self.values = self.rng.integers(-32768, 32768, self.batch_size).tolist()
+            self.position = 0
+        value = self.values[self.position]
+        self.position += 1
+        return value
+
+
+class ReplayError(ValueError):
+    pass
+
+
+class Recorder(InputProvider):
+    # Logs every read of the wrapped provider with its cycle. A read at or
+    # before an already recorded cycle (after stepping back or restoring a
+    # snapshot) drops the records it replaces, so the log follows the
+    # timeline that was kept.
+    def __init__(self, source: InputProvider):
+        self.source = source
+        self.records: list[tuple[int, int, int]] = []
+
+    def read(self, slot: int, cycle: int, inputs: np.ndarray) -> int:
+        self.rewind(cycle)
+        value = self.source.read(slot, cycle, inputs)
+        self.records.append((cycle, slot, value))
+        return value
+
+    def rewind(self, cycle: int):
+        rewind(self.records, cycle)
+
+    def reset(self):
+        self.records.clear()
+
+    def save(self, file: BinaryIO):
+        pack = RECORD.pack
+        file.write(b"".join(pack(cycle, slot, value) for cycle, slot, value in self.records))
+
+
+class Replay(InputProvider):
+    # plays a recording back, every read has to happen at the recorded cycle
+    # and slot
+    def __init__(self, records: list[tuple[int, int, int]]):
+        self.records = records
+        self.position = 0
+
+    @classmethod
+    def load(cls, file: BinaryIO) -> "Replay":
+        return cls(list(RECORD.iter_unpack(file.read())))
+
+    def read(self, slot: int, cycle: int, inputs: np.ndarray) -> int:
+        if self.position == len(self.records):
+            raise ReplayError(f"Recording ended before the read of input {slot} at cycle {cycle}")
+        recorded_cycle, recorded_slot, value = self.records[self.position]
+        if (recorded_cycle, recorded_slot) != (cycle, slot):
+            raise ReplayError(f"Read of input {slot} at cycle {cycle}, "
+                              f"the recording has input {recorded_slot} at cycle {recorded_cycle}")
+        self.position += 1
+        return value
@@ -0,0 +1,161 @@
+from collections import deque
+
+from input_stream import Replay, rewind
+from program import Opcode
+from snapshot import Snapshot
+
+DEFAULT_MAX_ENTRIES = 500_000
+DEFAULT_CHECKPOINT_INTERVAL = 100_000
+DEFAULT_MAX_CHECKPOINTS = 64
+
+# change kinds
+CACHE = 0
+BANK = 1
+SWITCH = 2
+OUTPUT = 3
+
+# what a screen op changed, OUTPUT changes carry one of these
+SCREEN = 0
+BUFFER = 1
+LAMP = 2
+
+# plain ints, comparing against enum members on every step is slow
+OP_SVA = int(Opcode.SVA)
+OP_SVA_OUTPUT = int(Opcode.SVA_OUTPUT)
+OP_RW = int(Opcode.RW)
+OP_RC = int(Opcode.RC)
+OP_INPUTS = {int(Opcode.LA_INPUT), int(Opcode.LB_INPUT)}
+
+
+class Journal:
+    # One entry per executed instruction holding only what it is about to
+    # overwrite: (ip, a, b, c, running, (slot, old value) of an input read,
+    # change). The entries are bounded, older history is rebuilt by restoring
+    # a checkpoint and running forward again, with the input reads logged
+    # since the oldest checkpoint played back. Streamed output sinks can't be
+    # rewound.
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+                 max_checkpoints: int = DEFAULT_MAX_CHECKPOINTS):
+        self.entries: deque[tuple] = deque(maxlen=max_entries)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints: deque[tuple[Snapshot, int]] = deque(maxlen=max_checkpoints)
+        self.next_checkpoint = 0
+        # (cycle, slot, value) of every input read
+        self.reads: deque[tuple[int, int, int]] = deque()
+
+    def reset(self):
+        self.entries.clear()
+        self.checkpoints.clear()
+        self.reads.clear()
+        self.next_checkpoint = 0
+
+    def read_input(self, cycle: int, slot: int, value: int):
+        self.reads.append((cycle, slot, value))
+
+    def record(self, computer, opcode: int, operand: int):
+        # takes the decoded instruction, so recording doesn't build a Command
+        state = computer.state
+        if state.clock_cycle >= self.next_checkpoint:
+            self.checkpoints.append((computer.snapshot(), computer.output.count))
+            self.next_checkpoint = state.clock_cycle + self.checkpoint_interval
+            # reads before the oldest checkpoint can't be replayed any more
+            oldest = self.checkpoints[0][0].clock_cycle
+            while self.reads and self.reads[0][0] < oldest:
+                self.reads.popleft()
+
+        change = None
+        if opcode == OP_SVA:
+            change = (CACHE, operand, int(state.cache_slots[operand]))
+        elif opcode == OP_SVA_OUTPUT:
+            change = self.output_change(computer, operand)
+        elif opcode == OP_RW:
+            cell = state.b % 16
+            change = (BANK, cell, int(state.loaded_bank[cell]))
+        elif opcode == OP_RC and (state.b // 16) % 64 != state.loaded_bank_index:
+            change = (SWITCH, state.loaded_bank_index)
+
+        # input reads store what the provider returned in the inputs
+        read = None
+        if opcode in OP_INPUTS:
+            read = (operand, int(state.inputs[operand]))
+        registers = state.registers
+        self.entries.append((state.instruction_pointer, registers.a, registers.b, registers.c,
+                             state.running, read, change))
+
+    @staticmethod
+    def output_change(computer, register: int) -> tuple:
+        position = computer.state.screen_position
+        if register != 6:
+            return OUTPUT, position, None, None
+        match computer.state.a:
+            case 1:
+                return OUTPUT, position, SCREEN, computer.screen.copy()
+            case 2:
+                return OUTPUT, position, BUFFER, computer.screenbuffer
+            case 4 | 8 | 16 if position is not None:
+                x, y = position
+                return OUTPUT, position, LAMP, bool(computer.screenbuffer[x][y])
+        return OUTPUT, position, None, None
+
+    def undo(self, computer) -> tuple | None:
+        ip, a, b, c, running, read, change = self.entries.pop()
+        state = computer.state
+        state.instruction_pointer = ip
+        state.registers.a, state.registers.b, state.registers.c = a, b, c
+        state.running = running
+        state.clock_cycle -= 1
+        state.ticks -= computer.costs[ip]
+        if read is not None:
+            state.inputs[read[0]] = read[1]
+            rewind(self.reads, state.clock_cycle)
+
+        if change is None:
+            return None
+        kind = change[0]
+        if kind == CACHE:
+            state.cache_slots[change[1]] = change[2]
+        elif kind == BANK:
+            state.loaded_bank[change[1]] = change[2]
+        elif kind == SWITCH:
+            state.loaded_bank_index = change[1]
+        elif kind == OUTPUT:
+            _, position, target, old = change
+            computer.output.pop()
+            state.screen_position = position
+            if target == SCREEN:
+                computer.screen[:] = old
+            elif target == BUFFER:
+                computer.screenbuffer = old
+            elif target == LAMP:
+                x, y = position
+                computer.screenbuffer[x][y] = old
+        return change
+
+    def rebuild(self, computer) -> bool:
+        # refill the entries by running forward again from the latest
+        # checkpoint before the current cycle, step by step so breakpoints
+        # don't stop it and with the inputs that were read the first time
+        clock_cycle = computer.state.clock_cycle
+        while self.checkpoints and self.checkpoints[-1][0].clock_cycle >= clock_cycle:
+            self.checkpoints.pop()
+        if not self.checkpoints:
+            return False
+
+        checkpoint, output_count = self.checkpoints[-1]
+        computer.restore(checkpoint)
+        while computer.output.count > output_count:
+            computer.output.pop()
+        self.entries.clear()
+        self.next_checkpoint = checkpoint.clock_cycle + self.checkpoint_interval
+        reads = [read for read in self.reads if checkpoint.clock_cycle <= read[0] < clock_cycle]
+        # the replayed reads are logged again
+        rewind(self.reads, checkpoint.clock_cycle)
+        provider = computer.input_provider
+        computer.input_provider = Replay(reads)
+        try:
+            for _ in range(clock_cycle - checkpoint.clock_cycle):
+                computer.step()
+        finally:
+            computer.input_provider = provider
+        return bool(self.entries)
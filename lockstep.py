@@ -0,0 +1,221 @@
+import numpy as np
+
+from computer import Computer, Opcode, decode_program
+from input_stream import RANDOM_SLOT
+from output_log import DEFAULT_CAPACITY, OutputLog
+from program import Program, as_program
+from snapshot import BANK_COUNT, BANK_SIZE, Snapshot, frozen_copy, share_banks
+from timing import TimingModel
+
+JUMP_CONDITIONS = {
+    Opcode.JE: np.equal, Opcode.JNE: np.not_equal, Opcode.JG: np.greater,
+    Opcode.JL: np.less, Opcode.JGE: np.greater_equal, Opcode.JLE: np.less_equal,
+}
+
+
+def wrap(values: np.ndarray) -> np.ndarray:
+    return (values + 0x8000 & 0xFFFF) - 0x8000
+
+
+class LockstepComputer:
+    # Runs one program on many machines at once. The state of every machine is
+    # a row in the arrays below, each step executes the instruction at the
+    # lowest IP for all machines that are there, so machines that diverged
+    # catch up and run together again.
+    def __init__(self, program_data: str | Program, inputs: np.ndarray, output_capacity: int = DEFAULT_CAPACITY,
+                 seed: int | None = None, timing: TimingModel | None = None):
+        self.source = program_data
+        program = as_program(program_data)
+        self.program = program
+        self.timing = timing if timing is not None else TimingModel()
+        self.costs = self.timing.costs(program)
+        self.opcodes, self.operands = decode_program(program)
+        # lines with missing args fault
+        self.faulty = [opcode == Opcode.EXECUTE for opcode in self.opcodes]
+
+        inputs = np.asarray(inputs, np.int16)
+        count = len(inputs)
+        self.count = count
+        self.inputs = inputs.copy()
+        self.instruction_pointer = np.zeros(count, np.int64)
+        self.clock_cycle = np.zeros(count, np.int64)
+        self.ticks = np.zeros(count, np.int64)
+        self.running = np.ones(count, bool)
+        self.error = np.zeros(count, bool)
+        self.a = np.zeros(count, np.int64)
+        self.b = np.zeros(count, np.int64)
+        self.c = np.zeros(count, np.int64)
+        self.cache_slots = np.zeros((count, 32), np.int16)
+        self.ram = np.zeros((count, BANK_COUNT * BANK_SIZE), np.int16)
+        self.loaded_bank_index = np.zeros(count, np.int64)
+        # -1 until register 7 sets a position
+        self.screen_x = np.full(count, -1, np.int64)
+        self.screen_y = np.full(count, -1, np.int64)
+        self.screen = np.zeros((count, 64, 64), bool)
+        self.screenbuffer = np.zeros((count, 64, 64), bool)
+        self.outputs = [OutputLog(output_capacity) for _ in range(count)]
+        self.rng = np.random.default_rng(seed)
+
+        self.handlers = {opcode: getattr(self, f"_op_{opcode.name.lower()}", None) for opcode in Opcode}
+
+    def step(self, max_cycles: int | None = None) -> int:
+        # runs one instruction on the group of machines at the lowest IP and
+        # returns the group's size, 0 once every machine is done
+        active = self.running if max_cycles is None else self.running & (self.clock_cycle < max_cycles)
+        if not active.any():
+            return 0
+        ip = int(self.instruction_pointer[active].min())
+        idx = np.flatnonzero(active & (self.instruction_pointer == ip))
+        self.instruction_pointer[idx] = ip + 1
+
+        if self.faulty[ip]:
+            self.fail(idx)
+            return len(idx)
+        opcode = self.opcodes[ip]
+        if opcode in JUMP_CONDITIONS:
+            taken = idx[JUMP_CONDITIONS[opcode](self.a[idx], self.b[idx])]
+            self.instruction_pointer[taken] = self.operands[ip]
+        elif opcode != Opcode.NOP:
+            self.handlers[opcode](idx, self.operands[ip])
+
+        ok = idx[~self.error[idx]]
+        self.clock_cycle[ok] += 1
+        self.ticks[ok] += self.costs[ip]
+        self.running[ok] &= self.instruction_pointer[ok] < len(self.program)
+        return len(idx)
+
+    def run(self, max_cycles: int | None = None) -> int:
+        # runs every machine until it stops or reaches max_cycles, returns the
+        # number of lockstep steps it took
+        steps = 0
+        while self.step(max_cycles):
+            steps += 1
+        return steps
+
+    def fail(self, idx: np.ndarray):
+        # where Computer would raise, the machine stops and keeps its state
+        self.error[idx] = True
+        self.running[idx] = False
+
+    def _op_la(self, idx, arg):
+        self.a[idx] = self.cache_slots[idx, arg]
+
+    def _op_lb(self, idx, arg):
+        self.b[idx] = self.cache_slots[idx, arg]
+
+    def read_inputs(self, idx, arg):
+        if arg == RANDOM_SLOT:
+            self.inputs[idx, arg] = self.rng.integers(-32768, 32768, len(idx))
+        return self.inputs[idx, arg]
+
+    def _op_la_input(self, idx, arg):
+        self.a[idx] = self.read_inputs(idx, arg)
+
+    def _op_lb_input(self, idx, arg):
+        self.b[idx] = self.read_inputs(idx, arg)
+
+    def _op_lal(self, idx, arg):
+        self.a[idx] = arg & 255
+
+    def _op_lah(self, idx, arg):
+        self.a[idx] = wrap(self.a[idx] | (arg & 255) << 8)
+
+    def _op_lbl(self, idx, arg):
+        self.b[idx] = arg & 255
+
+    def _op_lbh(self, idx, arg):
+        self.b[idx] = wrap(self.b[idx] | (arg & 255) << 8)
+
+    def _op_lcl(self, idx, arg):
+        self.c[idx] = arg & 255
+
+    def _op_sva(self, idx, arg):
+        self.cache_slots[idx, arg] = self.a[idx]
+
+    def _op_sva_output(self, idx, arg):
+        values = self.a[idx]
+        for i, value in zip(idx.tolist(), values.tolist()):
+            self.outputs[i].write(arg, value, int(self.clock_cycle[i]))
+        if arg == 7:
+            self.screen_x[idx] = values & 0x3f
+            self.screen_y[idx] = values >> 8 & 0x3f
+        elif arg == 6:
+            self.fail(idx[self.screen_x[idx] < 0])
+            idx = idx[self.screen_x[idx] >= 0]
+            values = self.a[idx]
+            x, y = self.screen_x[idx], self.screen_y[idx]
+            show = idx[values == 1]
+            self.screen[show] = self.screenbuffer[show]
+            self.screenbuffer[idx[values == 2]] = False
+            lamps = values == 4
+            self.screenbuffer[idx[lamps], x[lamps], y[lamps]] = True
+            lamps = values == 8
+            self.screenbuffer[idx[lamps], x[lamps], y[lamps]] ^= True
+            lamps = values == 16
+            self.screenbuffer[idx[lamps], x[lamps], y[lamps]] = False
+
+    def _op_stp(self, idx, arg):
+        self.running[idx] = False
+
+    def _op_add(self, idx, arg):
+        self.a[idx] = wrap(self.a[idx] + self.b[idx])
+
+    def _op_sub(self, idx, arg):
+        self.a[idx] = wrap(self.a[idx] - self.b[idx])
+
+    def _op_and(self, idx, arg):
+        self.a[idx] &= self.b[idx]
+
+    def _op_or(self, idx, arg):
+        self.a[idx] |= self.b[idx]
+
+    def _op_xor(self, idx, arg):
+        self.a[idx] ^= self.b[idx]
+
+    def _op_sup(self, idx, arg):
+        self.a[idx] = wrap(self.a[idx] << arg) if arg < 16 else 0
+
+    def _op_sdn(self, idx, arg):
+        self.a[idx] >>= min(arg, 63)
+
+    def _op_mul(self, idx, arg):
+        self.a[idx] = wrap(self.a[idx] * self.b[idx])
+
+    def _op_inb(self, idx, arg):
+        self.b[idx] = wrap(self.b[idx] + 1)
+
+    def _op_rw(self, idx, arg):
+        self.ram[idx, (self.loaded_bank_index[idx] << 4) + (self.b[idx] & 15)] = self.a[idx]
+
+    def _op_rr(self, idx, arg):
+        self.a[idx] = self.ram[idx, (self.loaded_bank_index[idx] << 4) + (self.b[idx] & 15)]
+
+    def _op_rc(self, idx, arg):
+        self.loaded_bank_index[idx] = self.b[idx] >> 4 & 63
+
+    def _op_jmp(self, idx, arg):
+        self.instruction_pointer[idx] = arg
+
+    def snapshot(self, i: int) -> Snapshot:
+        position = None if self.screen_x[i] < 0 else (int(self.screen_x[i]), int(self.screen_y[i]))
+        return Snapshot(
+            instruction_pointer=int(self.instruction_pointer[i]),
+            clock_cycle=int(self.clock_cycle[i]),
+            ticks=int(self.ticks[i]),
+            registers=(int(self.a[i]), int(self.b[i]), int(self.c[i])),
+            running=bool(self.running[i]),
+            loaded_bank_index=int(self.loaded_bank_index[i]),
+            screen_position=position,
+            cache_slots=frozen_copy(self.cache_slots[i], None),
+            ram_banks=share_banks(self.ram[i].reshape(BANK_COUNT, BANK_SIZE), None),
+            inputs=frozen_copy(self.inputs[i], None),
+            screen=frozen_copy(self.screen[i], None),
+            screenbuffer=frozen_copy(self.screenbuffer[i], None),
+        )
+
+    def computer(self, i: int) -> Computer:
+        # a regular Computer holding machine i's state, e.g. for dumping or
+        # stepping it further in the debugger
+        computer = Computer(self.source, output=self.outputs[i], timing=self.timing)
+        computer.restore(self.snapshot(i))
+        return computer
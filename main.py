@@ -1,8 +1,24 @@
 import json
+import os
+import sys
+import time
+from bisect import bisect_left
+from functools import lru_cache
 
+import numpy as np
 import pygame
 
+import snapshot
+from breakpoints import Breakpoint, Breakpoints
 from computer import Computer, Command
+from emulator import Emulator
+from input_stream import RandomInput, Recorder
+from journal import Journal
+from output_log import OutputLog
+from preprocessor import (SOURCE_MAP_SUFFIX, CompiledSkript, address_labels as label_lines, compile_file, map_address,
+                          save_source_map)
+from program import MAX_ARG, RSB_SUFFIX, moved_address
+from watcher import SourceWatcher
 
 pygame.init()
 
@@ -17,10 +33,26 @@ font_code = pygame.font.SysFont("Consolas", 20)
 font_code_bold = pygame.font.SysFont("Consolas", 20, True)
 
 font_line = pygame.font.SysFont("Consolas", 18)
+font_label = pygame.font.SysFont("Consolas", 13)
+
+# layout metrics, all panels share the bold code font's line height
+ROW_HEIGHT = font_code_bold.size("LAL -128")[1]
+LINENUM_PAD = font_code_bold.size("63")[0] + 6
+PROGRAM_COL_WIDTH = font_code_bold.size("LAL -128")[0] + 10
+VALUE_COL_WIDTH = font_code_bold.size("-32762")[0] + 10
+INPUT_COL_WIDTH = font_code_bold.size("-32768")[0] + 10
+OUTPUT_COL_WIDTH = font_code_bold.size("0: -32768")[0] + 10
+
+TEXT_CACHE_SIZE = 4096
 icon = pygame.image.load("./images/redstone.png").convert_alpha()
 pygame.display.set_icon(icon)
 
 lamp_images = [pygame.image.load(f"./images/{i}.png").convert_alpha() for i in ("off", "turning_off", "turning_on", "on")]
+LAMP_SIZE = 6
+
+# the lamp panel is kept on its own surface and only changed lamps are redrawn
+screen_surface = pygame.Surface((64 * LAMP_SIZE, 64 * LAMP_SIZE))
+drawn_lamps = np.full((64, 64), -1, np.int8)
 
 edit_mode = False
 selected_command_idx: int = 0
@@ -30,34 +62,264 @@ input_mode = False
 selected_input_idx = 0
 selected_input = "0"
 
-pause_on_input = False
+# the program panel shows VIEW_LINES lines from view_start, it scrolls to keep
+# the IP (the cursor in edit mode) in view whenever that moves
+VIEW_LINES = 64
+SCROLL_LINES = 4
+view_start = 0
+followed_position = 0
+
+# G (Ctrl+G in edit mode) jumps the view to a line number or label
+goto_mode = False
+goto_text = ""
+goto_line: int | None = None
 
 with open("theme.json") as f:
     theme = json.load(f)
 
-with open("code.txt") as f:
-    computer = Computer(f.read())
+# .skript sources are compiled in memory, edits are saved next to them as .txt,
+# .rsb programs are saved in place
+program_path = sys.argv[1] if len(sys.argv) > 1 else "code.txt"
+save_path = program_path if program_path.endswith(RSB_SUFFIX) else os.path.splitext(program_path)[0] + ".txt"
+compiled = compile_file(program_path)
+# every input read is recorded, R saves the session for headless --replay
+recorder = Recorder(RandomInput())
+computer = Computer(compiled.code, input_provider=recorder)
+computer.journal = Journal()
+breakpoints = Breakpoints()
+computer.set_breakpoints(breakpoints)
+blank_state = computer.snapshot()
+# the computer runs on the emulator's worker thread, everything below reads the
+# frames it publishes and sends changes through emulator.submit()/call()
+emulator = Emulator(computer)
+frame = emulator.frame
+
+# source map lookups, rebuilt when the program is (re)loaded and labels are
+# moved along with editor inserts and deletes
+label_marks = dict(compiled.jump_marks)
+source_lines = list(compiled.lines)
+address_labels: list[str | None] = []
+sorted_labels: list[str] = []
+slot_names = compiled.slot_names()
+
+# external edits are compiled on a background thread and swapped in, either
+# keeping the machine state (the IP stays on the same label plus offset) or
+# starting over
+watcher = SourceWatcher(program_path)
+pending_reload = None
+reload_keeps_state = True
 
-auto_running = False
 STEPS_PER_SECOND = 60
-COMMANDS_PER_STEP = 1
-auto_max_cooldown = FPS / STEPS_PER_SECOND
-auto_cooldown = auto_max_cooldown
+MAX_STEPS_PER_SECOND = 65536
+steps_per_second = STEPS_PER_SECOND
+
+ips = 0.0
+ips_clock_cycle = 0
+ips_time = time.perf_counter()
 
 saved = True
 caption = "Redstone Debugger"
 
+SNAPSHOT_FILE = "snapshot.rsnap"
+RECORDING_FILE = "session.rinp"
+snapshots: list[snapshot.Snapshot] = []
+snapshot_idx = -1
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text, color, font):
+    return font.render(text, True, color)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_width(text, font):
+    return font.size(text)[0]
+
 
 def draw_text(text, pos, color=0xffffffff, bold=False, font=None):
     if font is None:
         font = font_code_bold if bold else font_code
-    screen.blit(font.render(text, True, color), pos)
+    screen.blit(render_text(text, color, font), pos)
+
+
+def format_ips(value):
+    if value >= 1_000_000:
+        return f"{value / 1_000_000:.1f}M"
+    if value >= 1_000:
+        return f"{value / 1_000:.1f}k"
+    return f"{value:.0f}"
+
+
+def update_labels():
+    global address_labels, sorted_labels
+    address_labels = label_lines(label_marks, len(computer.state.program_data))
+    sorted_labels = sorted(label_marks)
+
+
+def move_labels(idx, delta):
+    global label_marks
+    label_marks = {name: moved_address(address, idx, delta) for name, address in label_marks.items()}
+    if source_lines:
+        if delta > 0:
+            # a new line belongs to the source line of the one it follows
+            source_lines.insert(idx, source_lines[max(idx - 1, 0)])
+        elif idx < len(source_lines):
+            del source_lines[idx]
+    update_labels()
+
+
+def swap_labels(first, second):
+    global label_marks
+    swapped = {first: second, second: first}
+    label_marks = {name: swapped.get(address, address) for name, address in label_marks.items()}
+    if max(first, second) < len(source_lines):
+        source_lines[first], source_lines[second] = source_lines[second], source_lines[first]
+    update_labels()
+
+
+def find_line(text):
+    # a line number, a label or the first label starting with text
+    if text.isdecimal():
+        address = int(text)
+    elif text in label_marks:
+        address = label_marks[text]
+    else:
+        idx = bisect_left(sorted_labels, text)
+        if idx == len(sorted_labels) or not sorted_labels[idx].startswith(text):
+            return None
+        address = label_marks[sorted_labels[idx]]
+    return min(address, len(computer.state.program_data) - 1)
+
+
+def scroll_to(start):
+    global view_start
+    view_start = max(min(start, len(computer.state.program_data) - VIEW_LINES), 0)
+
+
+def follow(position):
+    global followed_position, goto_line
+    if position == followed_position:
+        return
+    followed_position = position
+    if not view_start <= position < view_start + VIEW_LINES:
+        goto_line = None
+        scroll_to(position - VIEW_LINES // 4)
+
+
+def set_speed(new_steps_per_second):
+    global steps_per_second
+    steps_per_second = min(max(new_steps_per_second, 1), MAX_STEPS_PER_SECOND)
+    emulator.steps_per_second = steps_per_second
+
+
+# the functions below change the machine and run on the worker thread
+
+def restore_snapshot(snap):
+    emulator.auto_running = False
+    computer.restore(snap)
+    computer.journal.reset()
+
+
+def toggle_breakpoint(line):
+    breakpoints.toggle_line(line)
+    computer.set_breakpoints(breakpoints)
+
+
+def toggle_watch(slot):
+    breakpoints.toggle_watch("cache", slot)
+    computer.set_breakpoints(breakpoints)
+
+
+def toggle_profile():
+    if computer.profile is None:
+        computer.start_profile()
+    else:
+        computer.stop_profile()
+
+
+def delete_line(idx):
+    state = computer.state
+    computer.delete_line(idx)
+    if len(state.program_data) == state.instruction_pointer:
+        state.instruction_pointer -= 1
+    if len(state.program_data) == 0:
+        computer.insert_line(0, Command(""))
+        state.instruction_pointer = 0
+
+
+def swap_program(reload, old_marks, keep_state):
+    state = computer.state
+    ip = map_address(state.instruction_pointer, old_marks, reload.compiled.jump_marks)
+    computer.load_program(reload.program)
+    if keep_state:
+        state.instruction_pointer = ip
+        if ip >= len(reload.program):
+            state.running = False
+    else:
+        emulator.auto_running = False
+        computer.restore(blank_state)
+        computer.output = OutputLog()
+        recorder.reset()
+    computer.journal.reset()
+
+
+def save_recording():
+    # reads after the current cycle were stepped back over
+    recorder.rewind(computer.state.clock_cycle)
+    with open(RECORDING_FILE, "wb") as f:
+        recorder.save(f)
+    return len(recorder.records)
+
+
+def save_program():
+    program = computer.state.program_data
+    if save_path.endswith(RSB_SUFFIX):
+        # the loaded program may still be a mapping of the old file
+        with open(save_path + ".tmp", "wb") as f:
+            program.save(f)
+        os.replace(save_path + ".tmp", save_path)
+    else:
+        with open(save_path, "w") as f:
+            f.write(program.text())
+    # compile_file reads the map next to the saved program, keep it in step
+    # with the edits or drop it when there is nothing left to map
+    map_path = os.path.splitext(save_path)[0] + SOURCE_MAP_SUFFIX
+    if label_marks or compiled.vars:
+        lines = source_lines if len(source_lines) == len(program) else []
+        save_source_map(CompiledSkript(program, dict(label_marks), compiled.vars, lines), map_path, program_path)
+    elif os.path.exists(map_path):
+        os.remove(map_path)
+
+
+def jump_to_snapshot(idx):
+    global snapshot_idx
+    snapshot_idx = idx
+    emulator.call(restore_snapshot, snapshots[snapshot_idx])
+
+
+def apply_reload(reload):
+    global compiled, caption, label_marks, source_lines, slot_names
+    if reload.error is not None:
+        caption = f"Redstone Debugger (reload failed: {reload.error!r})"
+        return
+    if reload.program.text() == computer.state.program_data.text():
+        # our own save
+        compiled = reload.compiled
+        return
+
+    emulator.call(swap_program, reload, label_marks, reload_keeps_state)
+    compiled = reload.compiled
+    label_marks = dict(compiled.jump_marks)
+    source_lines = list(compiled.lines)
+    update_labels()
+    slot_names = compiled.slot_names()
+    caption = "Redstone Debugger (reloaded)"
 
 
 def draw_value(value, label, pos):
     draw_text(label, pos, 0x9f9f9fff, True)
     draw_text(f"{value}",
-              (pos[0] + font_code_bold.size(label)[0], pos[1]), 0xf0f0f0ff)
+              (pos[0] + text_width(label, font_code_bold), pos[1]), 0xf0f0f0ff)
 
 
 def draw_command(command: Command, pos: tuple[int, int]):
@@ -65,7 +327,7 @@ def draw_command(command: Command, pos: tuple[int, int]):
         command.name, {"type": "unknown", "arg": "unknown"})
     draw_text(command.name, pos, theme["colors"][command_color["type"]])
     if command.arg is not None:
-        draw_text(f" {command.arg}", (pos[0] + font_code.size(command.name)[0], pos[1]),
+        draw_text(f" {command.arg}", (pos[0] + text_width(command.name, font_code), pos[1]),
                   theme["colors"][command_color["arg"]])
 
 
@@ -86,42 +348,75 @@ def draw_selection(col_width, pad, row_height, text_x, text_y):
 
 
 def draw_program():
-    col_width = font_code_bold.size("LAL -128")[0] + 10
-    row_height = font_code_bold.size("LAL -128")[1]
+    col_width = PROGRAM_COL_WIDTH
+    row_height = ROW_HEIGHT
 
     hofs = 10
     vofs = 10 + row_height
     pad = 2
-    linenumpad = font_code_bold.size("63")[0] + 6
-
-    for i in range(64):
-        draw_text(str(i), (hofs + pad * 2 + i // 32 * (col_width + linenumpad + pad),
+    linenumpad = LINENUM_PAD
+
+    program = computer.state.program_data
+    start = view_start
+    end = min(start + VIEW_LINES, len(program))
+
+    # with profiling on, executed lines get a heat colour on a log scale
+    heat = None
+    if frame.line_counts is not None:
+        counts = frame.line_counts[start:end]
+        if counts.size and counts.max():
+            heat = np.log1p(counts) / np.log1p(counts.max())
+
+    # lines jumped to get a marker in front
+    targets = program.jump_targets()
+    targets = set(targets[np.searchsorted(targets, start):np.searchsorted(targets, end)].tolist())
+
+    # line numbers with a breakpoint are drawn red, only the last two digits
+    # fit, the header has the full range
+    for i in range(VIEW_LINES):
+        draw_text(str((start + i) % 100), (hofs + pad * 2 + i // 32 * (col_width + linenumpad + pad),
                            vofs + pad + i % 32 * row_height),
-                  0x707070ff, font=font_line)
-        
-    position = selected_command_idx if edit_mode else computer.state.instruction_pointer
-    start = position // 64 * 64
-
-    draw_text("Program: ", (hofs, vofs - row_height), 0xffffffff, True)
-    draw_text(f"(Page {position // 64})", (hofs + font_code_bold.size("Program: ")[0], vofs - row_height), 0x9f9f9fff)
-    
-    for i, command in enumerate(computer.state.program_data[start:start + 64]):
+                  0xf07676ff if start + i < len(breakpoints.lines) and breakpoints.lines[start + i] else 0x707070ff,
+                  font=font_line)
+
+    if goto_mode:
+        draw_text("Go to: ", (hofs, vofs - row_height), 0xffffffff, True)
+        draw_text(goto_text + "_", (hofs + text_width("Go to: ", font_code_bold), vofs - row_height), 0xf0f0f0ff)
+    else:
+        draw_text("Program: ", (hofs, vofs - row_height), 0xffffffff, True)
+        draw_text(f"({start}-{end - 1} of {len(program)})",
+                  (hofs + text_width("Program: ", font_code_bold), vofs - row_height), 0x9f9f9fff)
+
+    for i, command in enumerate(program[start:end]):
         text_x = hofs + pad * 2 + linenumpad + \
                  i // 32 * (col_width + linenumpad + pad)
         text_y = vofs + pad + i % 32 * row_height
+        if heat is not None and heat[i]:
+            pygame.draw.rect(screen, (int(40 + 150 * heat[i]), int(30 + 60 * heat[i]), 30),
+                             (text_x, text_y, col_width - pad, row_height))
         if edit_mode:
             if i + start == selected_command_idx:
                 draw_selection(col_width, pad, row_height, text_x, text_y)
-                cursor_ofs = font_code.size(selected_command)[0]
+                cursor_ofs = text_width(selected_command, font_code)
                 pygame.draw.line(screen, 0xf0f0f0,
                                  (text_x + cursor_ofs, text_y + 2),
                                  (text_x + cursor_ofs, text_y + row_height - 2), 2)
         else:
-            if computer.state.running and i + start == computer.state.instruction_pointer:
+            if frame.running and i + start == frame.instruction_pointer:
                 pygame.draw.rect(screen, 0x404040,
                                  (text_x, text_y, col_width - pad, row_height))
+            if i + start == goto_line:
+                pygame.draw.rect(screen, 0x9f9f9f,
+                                 (text_x, text_y, col_width - pad, row_height), 1)
+        if i + start in targets:
+            pygame.draw.line(screen, 0x8080a0, (text_x - 2, text_y + 3), (text_x - 2, text_y + row_height - 3), 2)
 
         draw_command(command, (text_x, text_y))
+        label = address_labels[i + start] if i + start < len(address_labels) else None
+        if label is not None:
+            pygame.draw.line(screen, 0x505060, (text_x, text_y), (text_x + col_width - pad * 2, text_y))
+            draw_text(label, (text_x + col_width - pad * 3 - text_width(label, font_label), text_y),
+                      0x8080a0ff, font=font_label)
 
     # outline
     pygame.draw.rect(screen, 0xd0e0e0,
@@ -133,29 +428,39 @@ def draw_program():
     pygame.draw.line(screen, 0xd0e0e0,
                      (splitter_x, vofs), (splitter_x, vofs + row_height * 32), 1)
 
-    if not computer.state.running:
+    if not frame.running:
         draw_text("Program stopped", (hofs, vofs + pad *
                                       2 + row_height * 32), 0xf07676ff, True)
+    elif frame.hit is not None:
+        draw_text("Breakpoint hit" if isinstance(frame.hit, Breakpoint) else "Watchpoint hit",
+                  (hofs, vofs + pad * 2 + row_height * 32), 0xf07676ff, True)
 
 
 def draw_cache():
-    col_width = font_code_bold.size("-32762")[0] + 10
-    row_height = font_code_bold.size("-32762")[1]
+    col_width = VALUE_COL_WIDTH
+    row_height = ROW_HEIGHT
 
     hofs = 290
     vofs = 10 + row_height
     pad = 2
-    linenumpad = font_code_bold.size("63")[0] + 6
+    linenumpad = LINENUM_PAD
 
     draw_text("Cache:", (hofs, vofs - row_height), 0xffffffff, True)
 
+    watched = {watch.index for watch in breakpoints.watchpoints if watch.kind == "cache"}
     for i in range(32):
         draw_text(str(i),
                   (hofs + pad * 2 + i // 16 * (col_width + linenumpad + pad),
                    vofs + pad + i % 16 * row_height),
-                  0x707070ff, font=font_line)
+                  0xf07676ff if i in watched else 0x707070ff, font=font_line)
 
-    draw_list(col_width, hofs, linenumpad, pad, row_height, vofs, computer.state.cache_slots)
+    draw_list(col_width, hofs, linenumpad, pad, row_height, vofs, frame.cache_slots)
+    for i, name in enumerate(slot_names):
+        if name is not None:
+            draw_text(name, (hofs + pad * 2 + linenumpad + i // 16 * (col_width + linenumpad + pad)
+                             + col_width - pad * 3 - text_width(name, font_label),
+                             vofs + pad + i % 16 * row_height + row_height - font_label.get_height()),
+                      0x8080a0ff, font=font_label)
 
     # outline
     pygame.draw.rect(screen, 0xd0e0e0,
@@ -169,22 +474,30 @@ def draw_cache():
 
 
 def draw_info():
-    line_height = font_code_bold.size("A: ")[1]
+    line_height = ROW_HEIGHT
     hofs = 290
     vofs = line_height * 18
 
-    draw_value(computer.state.a, "A: ", (hofs, vofs))
-    draw_value(computer.state.b, "B: ", (hofs, vofs + line_height))
-    draw_value(computer.state.c, "C: ", (hofs, vofs + line_height * 2))
-    draw_value(computer.state.clock_cycle, "Clock Cycle: ",
+    a, b, c = frame.registers
+    draw_value(a, "A: ", (hofs, vofs))
+    draw_value(b, "B: ", (hofs, vofs + line_height))
+    draw_value(c, "C: ", (hofs, vofs + line_height * 2))
+    draw_value(frame.clock_cycle, "Clock Cycle: ",
                (hofs, vofs + line_height * 3))
-    draw_value(computer.state.instruction_pointer,
+    draw_value(frame.instruction_pointer,
                "Instruction: ", (hofs, vofs + line_height * 4))
 
+    speed_hofs = hofs + text_width("A: -32768 ", font_code_bold)
+    draw_value(format_ips(ips), "IPS: ", (speed_hofs, vofs))
+    speed = "Turbo" if emulator.turbo else f"{steps_per_second}/s"
+    draw_text(speed, (speed_hofs, vofs + line_height), 0xffa500ff if emulator.turbo else 0x9f9f9fff)
+    draw_text("Reload: keep" if reload_keeps_state else "Reload: reset", (speed_hofs, vofs + line_height * 2),
+              0x9f9f9fff)
+
 
 def draw_output():
-    line_height = font_code_bold.size("0")[1]
-    col_width = font_code_bold.size("0: -32768")[0] + 10
+    line_height = ROW_HEIGHT
+    col_width = OUTPUT_COL_WIDTH
 
     hofs = 290
     vofs = 10 + line_height * 24
@@ -192,9 +505,9 @@ def draw_output():
 
     draw_text("Output:", (hofs, vofs - line_height), 0xffffffff, True)
     for i in range(1, 10):
-        if i > len(computer.output):
+        if i > len(frame.output):
             break
-        value = computer.output[-i]
+        value = frame.output[-i]
         draw_value(str(value[1]), f"{value[0]}: ",
                    (hofs + pad, vofs + pad + line_height * (i - 1)))
 
@@ -206,15 +519,15 @@ def draw_output():
 
 
 def draw_ram():
-    col_width = font_code_bold.size("-32762")[0] + 10
-    row_height = font_code_bold.size("-32762")[1]
+    col_width = VALUE_COL_WIDTH
+    row_height = ROW_HEIGHT
 
     hofs = 530
     vofs = 10 + row_height
     pad = 2
-    linenumpad = font_code_bold.size("63")[0] + 6
+    linenumpad = LINENUM_PAD
 
-    draw_text(f"Loaded Bank: {computer.state.loaded_bank_index}",
+    draw_text(f"Loaded Bank: {frame.loaded_bank_index}",
               (hofs, vofs - row_height), 0xffffffff, True)
 
     for i in range(16):
@@ -223,7 +536,7 @@ def draw_ram():
                    vofs + pad + i % 16 * row_height),
                   0x707070ff, font=font_line)
 
-    draw_list(col_width, hofs, linenumpad, pad, row_height, vofs, computer.state.loaded_bank)
+    draw_list(col_width, hofs, linenumpad, pad, row_height, vofs, frame.loaded_bank)
 
     # outline
     pygame.draw.rect(screen, 0xd0e0e0,
@@ -233,16 +546,16 @@ def draw_ram():
 
 
 def draw_input():
-    col_width = font_code_bold.size("-32768")[0] + 10
-    row_height = font_code_bold.size("-32768")[1]
+    col_width = INPUT_COL_WIDTH
+    row_height = ROW_HEIGHT
 
     hofs = 430
     vofs = 10 + row_height * 24
     pad = 2
-    linenumpad = font_code_bold.size("63")[0] + 6
+    linenumpad = LINENUM_PAD
 
     draw_text("Input:", (hofs, vofs - row_height), 0xffffffff, True)
-    if pause_on_input:
+    if emulator.pause_on_input:
         draw_text("Pause on input", (hofs, vofs + row_height * 8 + pad * 2), 0xafffafff, True)
 
     for i in range(8):
@@ -250,7 +563,7 @@ def draw_input():
                            vofs + pad + i % 32 * row_height),
                   0x707070ff, font=font_line)
 
-    for i, input_slot in enumerate(computer.state.inputs):
+    for i, input_slot in enumerate(frame.inputs):
         text_x = hofs + pad * 2 + linenumpad
         text_y = vofs + pad + i % 32 * row_height
 
@@ -269,39 +582,78 @@ def draw_input():
 def draw_screen():
     hofs = 670
     vofs = 310
-    
-    for i in range(64):
-        x = 63 - i
-        for j in range(64):
-            y = 63 - j
-            screen_x = hofs + i * 6
-            screen_y = vofs + j * 6
-            screen.blit(lamp_images[computer.screen[x][y] + computer.screenbuffer[x][y] * 2], (screen_x, screen_y))
 
+    lamps = frame.screen.astype(np.int8) | frame.screenbuffer.astype(np.int8) << 1
+    changed = np.argwhere(lamps != drawn_lamps)
+    if len(changed):
+        screen_surface.blits([(lamp_images[lamps[x, y]], ((63 - x) * LAMP_SIZE, (63 - y) * LAMP_SIZE))
+                              for x, y in changed.tolist()], False)
+        drawn_lamps[:] = lamps
+    screen.blit(screen_surface, (hofs, vofs))
+
+update_labels()
 while True:
+    frame = emulator.frame
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             pygame.quit()
             quit()
+        elif event.type == pygame.MOUSEWHEEL:
+            scroll_to(view_start - event.y * SCROLL_LINES)
         elif event.type == pygame.KEYDOWN:
+            if goto_mode:
+                if event.key == pygame.K_RETURN:
+                    line = find_line(goto_text)
+                    if line is None:
+                        caption = f"Redstone Debugger (no line or label {goto_text!r})"
+                        continue
+                    goto_mode = False
+                    scroll_to(line - VIEW_LINES // 4)
+                    if edit_mode:
+                        selected_command_idx = line
+                        selected_command = computer.state.program_data[selected_command_idx].repr()
+                        followed_position = line
+                    else:
+                        goto_line = line
+                elif event.key == pygame.K_ESCAPE:
+                    goto_mode = False
+                elif event.key == pygame.K_BACKSPACE:
+                    goto_text = goto_text[:-1]
+                elif event.unicode.isprintable() and not event.unicode.isspace():
+                    goto_text += event.unicode
+                continue
+
             if event.key == pygame.K_TAB:
                 edit_mode = not edit_mode
                 caption = "Redstone Debugger" + (" (edit mode)" if edit_mode else "")
                 if edit_mode:
                     input_mode = False
-                    computer.state.inputs[selected_input_idx] = int(selected_input)
-                    selected_command_idx = computer.state.instruction_pointer
+                    emulator.call(emulator.set_input, selected_input_idx, int(selected_input))
+                    emulator.call(emulator.set_auto_running, False)
+                    frame = emulator.frame
+                    selected_command_idx = min(frame.instruction_pointer, len(computer.state.program_data) - 1)
                     selected_command = computer.state.program_data[selected_command_idx].repr()
-                    auto_running = False
 
+            if event.key == pygame.K_F2:
+                emulator.call(toggle_breakpoint, selected_command_idx if edit_mode else frame.instruction_pointer)
+
+            if event.key in (pygame.K_PAGEUP, pygame.K_PAGEDOWN):
+                lines = VIEW_LINES if event.key == pygame.K_PAGEDOWN else -VIEW_LINES
+                if edit_mode:
+                    selected_command_idx = max(min(selected_command_idx + lines,
+                                                   len(computer.state.program_data) - 1), 0)
+                    selected_command = computer.state.program_data[selected_command_idx].repr()
+                else:
+                    scroll_to(view_start + lines)
+
+            # program_data is only changed by calls from here, so reading it
+            # directly is safe while the worker runs
             if edit_mode:
                 if event.key == pygame.K_DOWN:
                     if pygame.key.get_mods() & pygame.KMOD_ALT and selected_command_idx < len(
                         computer.state.program_data) - 1:
-                        computer.state.program_data[selected_command_idx], computer.state.program_data[
-                            selected_command_idx +
-                            1] = computer.state.program_data[selected_command_idx + 1], computer.state.program_data[
-                            selected_command_idx]
+                        emulator.call(computer.swap_lines, selected_command_idx, selected_command_idx + 1)
+                        swap_labels(selected_command_idx, selected_command_idx + 1)
                         selected_command_idx += 1
                     else:
                         selected_command_idx = min(
@@ -310,9 +662,8 @@ while True:
 
                 elif event.key == pygame.K_UP:
                     if pygame.key.get_mods() & pygame.KMOD_ALT and selected_command_idx > 0:
-                        computer.state.program_data[selected_command_idx], computer.state.program_data[
-                            selected_command_idx - 1] = computer.state.program_data[selected_command_idx - 1], \
-                            computer.state.program_data[selected_command_idx]
+                        emulator.call(computer.swap_lines, selected_command_idx, selected_command_idx - 1)
+                        swap_labels(selected_command_idx, selected_command_idx - 1)
                         selected_command_idx -= 1
                     else:
                         selected_command_idx = max(selected_command_idx - 1, 0)
@@ -333,22 +684,24 @@ while True:
                         selected_command = ""
                     # delete line
                     elif selected_command == "" and len(computer.state.program_data) > 1:
-                        del computer.state.program_data[selected_command_idx]
+                        emulator.call(computer.delete_line, selected_command_idx)
+                        move_labels(selected_command_idx, -1)
                         selected_command_idx = max(selected_command_idx - 1, 0)
                         selected_command = computer.state.program_data[selected_command_idx].repr(
                         )
                     else:
                         selected_command = selected_command[:-1]
-                    computer.state.program_data[selected_command_idx] = Command(
-                        selected_command)
+                    emulator.call(computer.set_line, selected_command_idx, Command(selected_command))
                     saved = False
 
                 elif event.key == pygame.K_s and pygame.key.get_mods() & pygame.KMOD_CTRL:
-                    with open("code.txt", "w") as f:
-                        f.write("\n".join(command.repr()
-                                          for command in computer.state.program_data))
+                    save_program()
                     saved = True
 
+                elif event.key == pygame.K_g and pygame.key.get_mods() & pygame.KMOD_CTRL:
+                    goto_mode = True
+                    goto_text = ""
+
                 elif event.key in (pygame.K_0, pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4,
                                    pygame.K_5, pygame.K_6, pygame.K_7, pygame.K_8, pygame.K_9,
                                    pygame.K_a, pygame.K_b, pygame.K_c, pygame.K_d, pygame.K_e,
@@ -360,27 +713,23 @@ while True:
 
                     new = selected_command + event.unicode.upper()
                     parts = new.split()
-                    if len(parts) > 1 and not parts[1].isdecimal():
+                    if len(parts) > 1 and (not parts[1].isdecimal() or int(parts[1]) > MAX_ARG):
                         continue
                     selected_command = new
-                    computer.state.program_data[selected_command_idx] = Command(
-                        selected_command)
+                    emulator.call(computer.set_line, selected_command_idx, Command(selected_command))
                     saved = False
 
                 elif event.key == pygame.K_RETURN:
-                    computer.state.program_data.insert(
-                        selected_command_idx + 1, Command(""))
+                    emulator.call(computer.insert_line, selected_command_idx + 1, Command(""))
+                    move_labels(selected_command_idx + 1, 1)
                     selected_command_idx += 1
                     selected_command = computer.state.program_data[selected_command_idx].repr()
                     saved = False
 
                 elif event.key == pygame.K_DELETE:
-                    del computer.state.program_data[selected_command_idx]
-                    if computer.state.instruction_pointer > selected_command_idx or len(computer.state.program_data) == computer.state.instruction_pointer:
-                        computer.state.instruction_pointer -= 1
-                    if len(computer.state.program_data) == 0:
-                        computer.state.program_data.append(Command(""))
-                    elif selected_command_idx == len(computer.state.program_data):
+                    emulator.call(delete_line, selected_command_idx)
+                    move_labels(selected_command_idx, -1)
+                    if selected_command_idx == len(computer.state.program_data):
                         selected_command_idx -= 1
                     selected_command = computer.state.program_data[selected_command_idx].repr()
                     saved = False
@@ -391,14 +740,14 @@ while True:
 
             elif input_mode:
                 if event.key == pygame.K_DOWN:
-                    computer.state.inputs[selected_input_idx] = int(selected_input)
+                    emulator.call(emulator.set_input, selected_input_idx, int(selected_input))
                     selected_input_idx = (selected_input_idx + 1) % 8
-                    selected_input = str(computer.state.inputs[selected_input_idx])
+                    selected_input = str(emulator.frame.inputs[selected_input_idx])
 
                 elif event.key == pygame.K_UP:
-                    computer.state.inputs[selected_input_idx] = int(selected_input)
+                    emulator.call(emulator.set_input, selected_input_idx, int(selected_input))
                     selected_input_idx = (selected_input_idx - 1) % 8
-                    selected_input = str(computer.state.inputs[selected_input_idx])
+                    selected_input = str(emulator.frame.inputs[selected_input_idx])
 
                 elif event.key == pygame.K_0:
                     if selected_input != "0" and selected_input != "-0":
@@ -426,49 +775,128 @@ while True:
 
                 elif event.key == pygame.K_i:
                     input_mode = False
-                    computer.state.inputs[selected_input_idx] = int(selected_input)
+                    emulator.submit(emulator.set_input, selected_input_idx, int(selected_input))
 
                 elif event.key == pygame.K_p:
-                    pause_on_input = not pause_on_input
+                    emulator.pause_on_input = not emulator.pause_on_input
 
                 elif event.key == pygame.K_ESCAPE:
                     input_mode = False
-                    computer.state.inputs[selected_input_idx] = int(selected_input)
+                    emulator.submit(emulator.set_input, selected_input_idx, int(selected_input))
 
             else:
                 if event.key in (pygame.K_RETURN, pygame.K_DOWN, pygame.K_RIGHT):
-                    if computer.state.running:
-                        auto_running = False
-                        computer.step()
+                    emulator.submit(emulator.step)
+
+                elif event.key in (pygame.K_LEFT, pygame.K_UP):
+                    command = computer.state.program_data[frame.instruction_pointer] \
+                        if frame.instruction_pointer < len(computer.state.program_data) else None
+                    # Shift+Left goes back to where the cache slot used by the current instruction was written
+                    if event.key == pygame.K_LEFT and pygame.key.get_mods() & pygame.KMOD_SHIFT and \
+                            command is not None and command.name in ("LA", "LB", "SVA") and \
+                            command.arg is not None and command.arg < 32:
+                        emulator.submit(emulator.step_back, command.arg)
+                    else:
+                        emulator.submit(emulator.step_back)
 
                 elif event.key == pygame.K_SPACE:
-                    auto_running = not auto_running
+                    emulator.submit(emulator.toggle_auto_running)
 
                 elif event.key == pygame.K_i:
                     input_mode = True
-                    selected_input = str(computer.state.inputs[selected_input_idx])
+                    selected_input = str(frame.inputs[selected_input_idx])
 
                 elif event.key == pygame.K_p:
-                    pause_on_input = not pause_on_input
-
-
-    if auto_running and computer.state.running and not edit_mode:
-        auto_cooldown -= 1
-        if auto_cooldown <= 0:
-            for _ in range(COMMANDS_PER_STEP):
-                if not computer.state.running:
-                    break
-                next_command = computer.step()
-                if pause_on_input and next_command.is_input():
-                    auto_running = False
-                    input_mode = True
-                    selected_input_idx = next_command.arg % 32
-                    selected_input = str(computer.state.inputs[selected_input_idx])
-                    break
+                    emulator.pause_on_input = not emulator.pause_on_input
+
+                elif event.key == pygame.K_w:
+                    # watch the cache slot used by the current instruction
+                    command = computer.state.program_data[frame.instruction_pointer] \
+                        if frame.instruction_pointer < len(computer.state.program_data) else None
+                    if command is not None and command.name in ("LA", "LB", "SVA") and \
+                            command.arg is not None and command.arg < 32:
+                        emulator.call(toggle_watch, command.arg)
+
+                elif event.key == pygame.K_F3:
+                    emulator.call(toggle_profile)
+
+                elif event.key == pygame.K_k:
+                    reload_keeps_state = not reload_keeps_state
 
-            auto_cooldown += auto_max_cooldown
+                elif event.key == pygame.K_r:
+                    reads = emulator.call(save_recording)
+                    caption = f"Redstone Debugger (saved {reads} input reads to {RECORDING_FILE})"
 
-    pygame.display.set_caption(caption + ("" if saved else "*"))
+                elif event.key == pygame.K_t:
+                    emulator.turbo = not emulator.turbo
+
+                elif event.key == pygame.K_g:
+                    goto_mode = True
+                    goto_text = ""
+
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                    set_speed(steps_per_second * 2)
+
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    set_speed(steps_per_second // 2)
+
+                elif event.key == pygame.K_F5:
+                    if pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                        if snapshots:
+                            with open(SNAPSHOT_FILE, "wb") as f:
+                                snapshot.save(snapshots[snapshot_idx], f)
+                    else:
+                        snapshots.append(emulator.call(computer.snapshot))
+                        snapshot_idx = len(snapshots) - 1
+
+                elif event.key == pygame.K_F9:
+                    if pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                        try:
+                            with open(SNAPSHOT_FILE, "rb") as f:
+                                snapshots.append(snapshot.load(f))
+                        except (OSError, ValueError, KeyError) as e:
+                            caption = f"Redstone Debugger (loading {SNAPSHOT_FILE} failed: {e!r})"
+                        else:
+                            jump_to_snapshot(len(snapshots) - 1)
+                    elif snapshots:
+                        jump_to_snapshot(snapshot_idx)
+
+                elif event.key == pygame.K_F7:
+                    if snapshots:
+                        jump_to_snapshot(max(snapshot_idx - 1, 0))
+
+                elif event.key == pygame.K_F8:
+                    if snapshots:
+                        jump_to_snapshot(min(snapshot_idx + 1, len(snapshots) - 1))
+
+
+    pending_reload = watcher.poll() or pending_reload
+    # never throw away unsaved edits from the built-in editor
+    if pending_reload is not None and saved and not edit_mode:
+        apply_reload(pending_reload)
+        pending_reload = None
+
+    # auto-run stopped in front of an input read with pause on input, or on
+    # an error in the program
+    while not emulator.events.empty():
+        kind, value = emulator.events.get()
+        if kind == "input" and not edit_mode:
+            input_mode = True
+            selected_input_idx = value
+            selected_input = str(emulator.frame.inputs[selected_input_idx])
+        elif kind == "error":
+            caption = f"Redstone Debugger (stopped: {value!r})"
+
+    frame = emulator.frame
+    follow(selected_command_idx if edit_mode else frame.instruction_pointer)
+    now = time.perf_counter()
+    if now - ips_time >= 0.5:
+        ips = max(frame.clock_cycle - ips_clock_cycle, 0) / (now - ips_time)
+        ips_clock_cycle = frame.clock_cycle
+        ips_time = now
+
+    snapshot_caption = f" [snapshot {snapshot_idx + 1}/{len(snapshots)}]" if snapshots else ""
+    pygame.display.set_caption(caption + ("" if saved else "*") + snapshot_caption)
 
     screen.fill(0x16161e)
     draw_program()
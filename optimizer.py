@@ -0,0 +1,486 @@
+import argparse
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from computer import JUMP_OPCODES, Computer, decode, wrap16
+from input_stream import DEFAULT_SEED, RandomInput
+from preprocessor import SOURCE_MAP_SUFFIX, CompiledSkript, compile_file, save_source_map
+from program import JUMPS, RSB_SUFFIX, Command, Opcode, Program, as_program
+from timing import DEFAULT_TIMING, TimingModel
+
+DEFAULT_CYCLES = 1_000_000
+# rounds of propagation and dead code removal, each one only runs again after
+# the other changed something, so this is only hit by pathological programs
+MAX_ROUNDS = 64
+
+# analysis locations as bits: the registers, then the 32 cache slots
+A = 1
+B = 2
+C = 4
+CACHE_SHIFT = 3
+LOCATIONS = CACHE_SHIFT + 32
+ALL = (1 << LOCATIONS) - 1
+# a successor index for leaving the program, by STP or by running off its end
+EXIT = -1
+
+# instructions that only write registers or cache slots, they can go when the
+# value they write is already there
+PURE_OPCODES = {Opcode.NOP, Opcode.LA, Opcode.LB, Opcode.LAL, Opcode.LAH, Opcode.LBL, Opcode.LBH, Opcode.LCL,
+                Opcode.SVA, Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR, Opcode.XOR, Opcode.SUP, Opcode.SDN,
+                Opcode.MUL, Opcode.INB, Opcode.RR}
+# and the ones that can go when the value they write is never read. Cache
+# slots are what a program that never stops leaves to look at, so stores to
+# them stay.
+DEAD_OPCODES = PURE_OPCODES - {Opcode.SVA}
+CONDITIONS = {
+    Opcode.JE: lambda a, b: a == b,
+    Opcode.JNE: lambda a, b: a != b,
+    Opcode.JG: lambda a, b: a > b,
+    Opcode.JL: lambda a, b: a < b,
+    Opcode.JGE: lambda a, b: a >= b,
+    Opcode.JLE: lambda a, b: a <= b,
+}
+# a low byte load and the high byte load after it build one 16 bit constant
+CONSTANT_PAIRS = {Opcode.LAH: (Opcode.LAL, 0), Opcode.LBH: (Opcode.LBL, 1)}
+
+
+def cache_bit(slot: int) -> int:
+    return 1 << CACHE_SHIFT + slot
+
+
+def effects(opcode: Opcode, arg: int) -> tuple[int, int]:
+    # (locations read, locations written), leaving the program reads all of them
+    match opcode:
+        case Opcode.LA:
+            return cache_bit(arg), A
+        case Opcode.LB:
+            return cache_bit(arg), B
+        case Opcode.LA_INPUT | Opcode.LAL:
+            return 0, A
+        case Opcode.LB_INPUT | Opcode.LBL:
+            return 0, B
+        case Opcode.LCL:
+            return 0, C
+        case Opcode.LAH | Opcode.SUP | Opcode.SDN:
+            return A, A
+        case Opcode.LBH | Opcode.INB:
+            return B, B
+        case Opcode.SVA:
+            return A, cache_bit(arg)
+        case Opcode.SVA_OUTPUT:
+            return A, 0
+        case Opcode.ADD | Opcode.SUB | Opcode.AND | Opcode.OR | Opcode.XOR | Opcode.MUL:
+            return A | B, A
+        case Opcode.RR:
+            return B, A
+        case Opcode.RW:
+            return A | B, 0
+        case Opcode.RC | Opcode.JE | Opcode.JNE | Opcode.JG | Opcode.JL | Opcode.JGE | Opcode.JLE:
+            return A | B, 0
+        case Opcode.STP | Opcode.EXECUTE:
+            return ALL, 0
+    return 0, 0
+
+
+def transfer(values: list[int | None], opcode: Opcode, arg: int):
+    # runs one instruction on known values, None for a value that isn't known
+    a, b = values[0], values[1]
+    match opcode:
+        case Opcode.LA:
+            values[0] = values[CACHE_SHIFT + arg]
+        case Opcode.LB:
+            values[1] = values[CACHE_SHIFT + arg]
+        case Opcode.LA_INPUT | Opcode.RR:
+            values[0] = None
+        case Opcode.LB_INPUT:
+            values[1] = None
+        case Opcode.LAL:
+            values[0] = arg & 255
+        case Opcode.LAH:
+            values[0] = None if a is None else wrap16(a | arg << 8)
+        case Opcode.LBL:
+            values[1] = arg & 255
+        case Opcode.LBH:
+            values[1] = None if b is None else wrap16(b | arg << 8)
+        case Opcode.LCL:
+            values[2] = arg & 255
+        case Opcode.SVA:
+            values[CACHE_SHIFT + arg] = a
+        case Opcode.SUP:
+            values[0] = None if a is None else wrap16(a << arg)
+        case Opcode.SDN:
+            values[0] = None if a is None else a >> arg
+        case Opcode.INB:
+            values[1] = None if b is None else wrap16(b + 1)
+        case Opcode.ADD | Opcode.SUB | Opcode.AND | Opcode.OR | Opcode.XOR | Opcode.MUL:
+            values[0] = None if a is None or b is None else arithmetic(opcode, a, b)
+        case Opcode.EXECUTE:
+            values[:] = [None] * LOCATIONS
+
+
+def arithmetic(opcode: Opcode, a: int, b: int) -> int:
+    match opcode:
+        case Opcode.ADD:
+            return wrap16(a + b)
+        case Opcode.SUB:
+            return wrap16(a - b)
+        case Opcode.AND:
+            return a & b
+        case Opcode.OR:
+            return a | b
+        case Opcode.XOR:
+            return a ^ b
+    return wrap16(a * b)
+
+
+def join(first: list[int | None], second: list[int | None]) -> list[int | None]:
+    return [x if x == y else None for x, y in zip(first, second)]
+
+
+@dataclass
+class ControlFlow:
+    # basic blocks as [start, end) line ranges with the indices of the blocks
+    # they continue in, EXIT for leaving the program
+    starts: list[int]
+    ends: list[int]
+    successors: list[list[int]]
+
+    @classmethod
+    def build(cls, opcodes: list[Opcode], operands: list[int]) -> "ControlFlow":
+        length = len(opcodes)
+        leaders = {0} if length else set()
+        for line, (opcode, arg) in enumerate(zip(opcodes, operands)):
+            if opcode in JUMP_OPCODES or opcode == Opcode.STP:
+                leaders.add(line + 1)
+            if opcode in JUMP_OPCODES:
+                leaders.add(arg)
+        starts = sorted(line for line in leaders if line < length)
+        ends = starts[1:] + [length] if starts else []
+        index = {start: block for block, start in enumerate(starts)}
+
+        def block_at(line: int) -> int:
+            return index[line] if line < length else EXIT
+
+        successors = []
+        for end in ends:
+            opcode, arg = opcodes[end - 1], operands[end - 1]
+            if opcode == Opcode.JMP:
+                successors.append([block_at(arg)])
+            elif opcode in JUMP_OPCODES:
+                successors.append([block_at(end), block_at(arg)])
+            elif opcode == Opcode.STP:
+                successors.append([EXIT])
+            else:
+                successors.append([block_at(end)])
+        return cls(starts, ends, successors)
+
+
+@dataclass
+class Optimized:
+    program: Program
+    # segment name -> address of its first line in the optimized program
+    jump_marks: dict[str, int]
+    # source line numbers of the kept lines, empty without a source map
+    lines: list[int]
+    # original line of every optimized line
+    origins: list[int]
+    # optimized address of every original address and the end, removed
+    # lines map to the line that followed them
+    addresses: list[int]
+    folded_jumps: int = 0
+    rounds: int = 0
+
+    @property
+    def removed(self) -> int:
+        return len(self.addresses) - 1 - len(self.program)
+
+    def compiled(self, original: CompiledSkript) -> CompiledSkript:
+        return CompiledSkript(self.program, self.jump_marks, original.vars, self.lines)
+
+
+class Optimizer:
+    # Rewrites a program to one that leaves the machine in the same state
+    # with fewer instructions executed. Each round either propagates known
+    # register and cache values (dropping loads and stores that don't change
+    # anything, deciding conditional jumps and with them unreachable code) or
+    # drops register writes that are never read. Every line taken out is
+    # one that can be skipped on all paths through it, so jumps to it move on
+    # to the next kept line. Leaving the program counts as reading every
+    # register, so the final registers match too.
+    def __init__(self, program: Program):
+        self.commands = list(program)
+        self.origins = list(range(len(self.commands)))
+        self.addresses = list(range(len(self.commands) + 1))
+        self.folded_jumps = 0
+        self.rounds = 0
+
+    def run(self, max_rounds: int = MAX_ROUNDS):
+        while self.rounds < max_rounds:
+            self.rounds += 1
+            if not self.apply(*self.propagate()) and not self.apply(self.eliminate(), {}):
+                break
+
+    def decoded(self) -> tuple[list[Opcode], list[int]]:
+        pairs = [decode(command) for command in self.commands]
+        return [opcode for opcode, _ in pairs], [arg for _, arg in pairs]
+
+    def propagate(self) -> tuple[set[int], dict[int, Command]]:
+        opcodes, operands = self.decoded()
+        flow = ControlFlow.build(opcodes, operands)
+        if not flow.starts:
+            return set(), {}
+        # nothing is known on entry, the program may be started on a used machine
+        entry: dict[int, list[int | None]] = {0: [None] * LOCATIONS}
+        work = [0]
+        while work:
+            block = work.pop()
+            values = list(entry[block])
+            for line in range(flow.starts[block], flow.ends[block]):
+                transfer(values, opcodes[line], operands[line])
+            for successor in self.taken(flow, block, values, opcodes, operands):
+                if successor == EXIT:
+                    continue
+                merged = values if successor not in entry else join(entry[successor], values)
+                if merged != entry.get(successor):
+                    entry[successor] = merged
+                    work.append(successor)
+
+        remove, replace = set(), {}
+        for block, (start, end) in enumerate(zip(flow.starts, flow.ends)):
+            if block not in entry:
+                remove.update(range(start, end))
+                continue
+            values = list(entry[block])
+            before = values
+            for line in range(start, end):
+                opcode, arg = opcodes[line], operands[line]
+                if opcode in PURE_OPCODES:
+                    previous, before = before, list(values)
+                    transfer(values, opcode, arg)
+                    _, written = effects(opcode, arg)
+                    if all(before[i] is not None and before[i] == values[i]
+                           for i in range(LOCATIONS) if written >> i & 1):
+                        remove.add(line)
+                    # or together with its low byte load, when the pair
+                    # rebuilds the constant already in the register
+                    pair = CONSTANT_PAIRS.get(opcode)
+                    if pair is not None and line > start and opcodes[line - 1] == pair[0]:
+                        register = pair[1]
+                        if previous[register] is not None and previous[register] == values[register]:
+                            remove.update((line - 1, line))
+                elif opcode in CONDITIONS:
+                    a, b = values[0], values[1]
+                    if arg == line + 1:
+                        remove.add(line)
+                    elif a is not None and b is not None:
+                        if CONDITIONS[opcode](a, b):
+                            replace[line] = Command.of("JMP", arg)
+                        else:
+                            remove.add(line)
+                elif opcode == Opcode.JMP and arg == line + 1:
+                    remove.add(line)
+                else:
+                    transfer(values, opcode, arg)
+        return remove, replace
+
+    @staticmethod
+    def taken(flow: ControlFlow, block: int, values: list[int | None],
+              opcodes: list[Opcode], operands: list[int]) -> list[int]:
+        # a conditional jump on known registers only goes one way
+        successors = flow.successors[block]
+        opcode = opcodes[flow.ends[block] - 1]
+        a, b = values[0], values[1]
+        if opcode in CONDITIONS and a is not None and b is not None:
+            return successors[1:] if CONDITIONS[opcode](a, b) else successors[:1]
+        return successors
+
+    def eliminate(self) -> set[int]:
+        opcodes, operands = self.decoded()
+        flow = ControlFlow.build(opcodes, operands)
+        blocks = len(flow.starts)
+        live_in = [0] * blocks
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(range(blocks)):
+                live = self.live_out(flow, block, live_in)
+                for line in reversed(range(flow.starts[block], flow.ends[block])):
+                    read, written = effects(opcodes[line], operands[line])
+                    live = live & ~written | read
+                if live != live_in[block]:
+                    live_in[block] = live
+                    changed = True
+
+        remove = set()
+        for block in range(blocks):
+            live = self.live_out(flow, block, live_in)
+            for line in reversed(range(flow.starts[block], flow.ends[block])):
+                opcode, arg = opcodes[line], operands[line]
+                read, written = effects(opcode, arg)
+                if opcode in DEAD_OPCODES and not written & live:
+                    remove.add(line)
+                else:
+                    live = live & ~written | read
+        return remove
+
+    @staticmethod
+    def live_out(flow: ControlFlow, block: int, live_in: list[int]) -> int:
+        live = 0
+        for successor in flow.successors[block]:
+            live |= ALL if successor == EXIT else live_in[successor]
+        return live
+
+    def apply(self, remove: set[int], replace: dict[int, Command]) -> bool:
+        if len(remove) == len(self.commands):
+            # the machine can't run an empty program
+            remove.discard(len(self.commands) - 1)
+        if not remove and not replace:
+            return False
+        for line, command in replace.items():
+            self.commands[line] = command
+        self.folded_jumps += len(replace)
+
+        # every address moves to the next kept line
+        length = len(self.commands)
+        moved = []
+        kept = 0
+        for line in range(length + 1):
+            moved.append(kept)
+            if line < length and line not in remove:
+                kept += 1
+        commands, origins = [], []
+        for line, (command, origin) in enumerate(zip(self.commands, self.origins)):
+            if line in remove:
+                continue
+            if command.name in JUMPS and command.arg is not None:
+                command = Command.of(command.name, moved[min(command.arg, length)])
+            commands.append(command)
+            origins.append(origin)
+        self.commands, self.origins = commands, origins
+        self.addresses = [moved[address] for address in self.addresses]
+        return True
+
+    def result(self, jump_marks: dict[str, int], lines: list[int]) -> Optimized:
+        end = len(self.addresses) - 1
+        return Optimized(
+            program=Program.of(self.commands),
+            jump_marks={name: self.addresses[min(mark, end)] for name, mark in jump_marks.items()},
+            lines=[lines[origin] for origin in self.origins] if len(lines) == end else [],
+            origins=self.origins,
+            addresses=self.addresses,
+            folded_jumps=self.folded_jumps,
+            rounds=self.rounds,
+        )
+
+
+def optimize(code: str | Program, jump_marks: dict[str, int] | None = None,
+             lines: list[int] | None = None, max_rounds: int = MAX_ROUNDS) -> Optimized:
+    optimizer = Optimizer(as_program(code))
+    optimizer.run(max_rounds)
+    return optimizer.result(jump_marks or {}, lines or [])
+
+
+def optimize_compiled(compiled: CompiledSkript, max_rounds: int = MAX_ROUNDS) -> tuple[CompiledSkript, Optimized]:
+    optimized = optimize(compiled.code, compiled.jump_marks, compiled.lines, max_rounds)
+    return optimized.compiled(compiled), optimized
+
+
+@dataclass
+class Savings:
+    # Both versions run on the same seeded inputs. The optimized program
+    # takes the same path minus the removed lines, so what it costs for the
+    # work the original did in its run comes from the original's line counts.
+    # The optimized program is then run for that many cycles and has to end
+    # up with the same outputs, cache and RAM, and the same registers if the
+    # original stopped.
+    cycles_before: int
+    cycles_after: int
+    ticks_before: int
+    ticks_after: int
+    stopped: bool
+    verified: bool
+
+    @property
+    def cycles_saved(self) -> int:
+        return self.cycles_before - self.cycles_after
+
+    @property
+    def ticks_saved(self) -> int:
+        return self.ticks_before - self.ticks_after
+
+    def report(self, timing: TimingModel) -> dict:
+        return {
+            "before": timing.report(self.cycles_before, self.ticks_before),
+            "after": timing.report(self.cycles_after, self.ticks_after),
+            "cycles_saved": self.cycles_saved,
+            "ticks_saved": self.ticks_saved,
+            "saved_fraction": self.cycles_saved / self.cycles_before if self.cycles_before else 0.0,
+            "stopped": self.stopped,
+            "verified": self.verified,
+        }
+
+
+def measure(code: str | Program, optimized: Optimized, cycles: int = DEFAULT_CYCLES,
+            seed: int = DEFAULT_SEED, timing: TimingModel | None = None) -> Savings:
+    timing = timing if timing is not None else TimingModel()
+    before = Computer(code, blocks=True, timing=timing, input_provider=RandomInput(seed))
+    profile = before.start_profile()
+    before.run(cycles)
+    counts = profile.line_counts()
+
+    after = Computer(optimized.program, blocks=True, timing=timing, input_provider=RandomInput(seed))
+    kept_counts = counts[optimized.origins]
+    cycles_after = int(kept_counts.sum())
+    ticks_after = int(np.dot(kept_counts, np.array(after.costs, np.int64)))
+    after.run(cycles_after)
+
+    first, second = before.state, after.state
+    verified = (list(before.output) == list(after.output)
+                and np.array_equal(first.cache_slots, second.cache_slots)
+                and np.array_equal(first.ram, second.ram)
+                and first.loaded_bank_index == second.loaded_bank_index
+                and np.array_equal(before.screen, after.screen))
+    if not first.running:
+        verified = verified and not second.running and (first.a, first.b, first.c) == (second.a, second.b, second.c)
+    return Savings(first.clock_cycle, cycles_after, first.ticks, ticks_after, not first.running, verified)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Optimize a compiled redstone program.")
+    parser.add_argument("source", help=".skript source, code.txt or .rsb program")
+    parser.add_argument("target", nargs="?", help="where to write the optimized program, .txt or .rsb")
+    parser.add_argument("-n", "--cycles", type=int, default=DEFAULT_CYCLES,
+                        help="cycle budget of the run measuring the savings")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="seed of the random input 7")
+    parser.add_argument("--timing", default=None, help=f"timing model for the ticks, {DEFAULT_TIMING} if it exists")
+    args = parser.parse_args(argv)
+
+    compiled = compile_file(args.source)
+    result, optimized = optimize_compiled(compiled)
+    if args.target is not None:
+        if args.target.endswith(RSB_SUFFIX):
+            with open(args.target, "wb") as f:
+                optimized.program.save(f)
+        else:
+            with open(args.target, "w") as f:
+                f.write(optimized.program.text())
+        save_source_map(result, os.path.splitext(args.target)[0] + SOURCE_MAP_SUFFIX, args.source)
+
+    timing_path = args.timing or (DEFAULT_TIMING if os.path.exists(DEFAULT_TIMING) else None)
+    timing = TimingModel.load(timing_path) if timing_path is not None else TimingModel()
+    savings = measure(compiled.code, optimized, args.cycles, args.seed, timing)
+    report = savings.report(timing)
+    length = len(optimized.addresses) - 1
+    print(f"lines: {length} -> {len(optimized.program)} ({optimized.removed} removed, "
+          f"{optimized.folded_jumps} jumps folded, {optimized.rounds} rounds)")
+    print(f"cycles: {savings.cycles_before} -> {savings.cycles_after} "
+          f"({savings.cycles_saved} saved, {report['saved_fraction']:.1%})"
+          + ("" if savings.stopped else f", first {args.cycles} cycles of the original"))
+    print(f"ticks: {savings.ticks_before} -> {savings.ticks_after} ({savings.ticks_saved} saved)")
+    print("verified:", savings.verified)
+
+
+if __name__ == "__main__":
+    main()
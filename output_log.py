@@ -0,0 +1,105 @@
+import json
+import struct
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import BinaryIO, Iterator, TextIO
+
+DEFAULT_CAPACITY = 1024
+DEFAULT_BATCH_SIZE = 4096
+# little endian (cycle: u64, register or input slot: u8, value: i16) records
+# of binary output streams and input recordings
+RECORD = struct.Struct("<QBh")
+
+
+class OutputSink(ABC):
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending: list = []
+
+    def write(self, cycle: int, register: int, value: int):
+        self.pending.append((cycle, register, value))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.write_batch(self.pending)
+            self.pending = []
+
+    @abstractmethod
+    def write_batch(self, batch: list[tuple[int, int, int]]):
+        ...
+
+    def close(self):
+        self.flush()
+
+
+class NDJSONSink(OutputSink):
+    def __init__(self, file: TextIO, batch_size: int = DEFAULT_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.file = file
+
+    def write_batch(self, batch: list[tuple[int, int, int]]):
+        self.file.write("".join(
+            json.dumps({"cycle": cycle, "register": register, "value": value}, separators=(",", ":")) + "\n"
+            for cycle, register, value in batch))
+
+    def close(self):
+        super().close()
+        self.file.flush()
+
+
+class BinarySink(OutputSink):
+    def __init__(self, file: BinaryIO, batch_size: int = DEFAULT_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.file = file
+
+    def write_batch(self, batch: list[tuple[int, int, int]]):
+        pack = RECORD.pack
+        self.file.write(b"".join(pack(cycle, register, value) for cycle, register, value in batch))
+
+    def close(self):
+        super().close()
+        self.file.flush()
+
+
+def read_binary(file: BinaryIO) -> Iterator[tuple[int, int, int]]:
+    yield from RECORD.iter_unpack(file.read())
+
+
+class OutputLog:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, sink: OutputSink | None = None, echo: bool = False,
+                 echo_file: TextIO | None = None):
+        self.entries: deque[tuple[int, int]] = deque(maxlen=capacity)
+        self.sink = sink
+        self.echo = echo
+        # stdout if None
+        self.echo_file = echo_file
+        self.count = 0
+
+    def write(self, register: int, value: int, cycle: int):
+        if self.echo:
+            print(value, file=self.echo_file)
+        self.entries.append((register, value))
+        self.count += 1
+        if self.sink is not None:
+            self.sink.write(cycle, register, value)
+
+    def pop(self):
+        # used when stepping backwards, writes already streamed to the sink stay
+        if self.entries:
+            self.entries.pop()
+        self.count -= 1
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, idx: int) -> tuple[int, int]:
+        return self.entries[idx]
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return iter(self.entries)
@@ -1,3 +1,14 @@
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from program import RSB_SUFFIX, Program, as_program
+
+COMPILE_CACHE_SIZE = 32
+SOURCE_MAP_SUFFIX = ".map"
+
 output_registers = {
     "screenpos": "39",
     "screenop": "38"
@@ -11,7 +22,7 @@ screen_ops = {
     "off": "16",
 }
 
-def decode_part(part: str):
+def decode_part(part: str, vars: dict[str, int]):
     if part.startswith("$"):
         return vars.setdefault(part, len(vars))
 
@@ -23,43 +34,139 @@ def decode_part(part: str):
     
     return part
 
-with open("code.skript") as f:
-    code = [line.strip() for line in f if line.strip()]
 
-vars: dict[str, int] = {}
+@dataclass(frozen=True)
+class CompiledSkript:
+    # .rsb files load straight into a Program
+    code: str | Program
+    # segment name -> address of its first line
+    jump_marks: dict[str, int]
+    # "$name" -> cache slot
+    vars: dict[str, int]
+    # source line number of every emitted instruction
+    lines: list[int] = field(default_factory=list)
 
-code_segments: list[tuple[str, list[str]]] = []
-code_segment_index = -1
-jump_marks: dict[str, int] = {}
+    def slot_names(self) -> list[str | None]:
+        names: list[str | None] = [None] * 32
+        for name, slot in self.vars.items():
+            if slot < 32:
+                names[slot] = name[1:]
+        return names
 
-for idx, line in enumerate(code):
-    parts = line.split()
-    parts = [decode_part(part) for part in parts]
-    line = code[idx] = " ".join(str(i) for i in parts)
-    
-    if line.endswith(":") and not line.startswith("#"):
-        code_segments.append((line[:-1], []))
-        code_segment_index += 1
-    
-    else:
-        code_segments[code_segment_index][1].append(line)
 
-offset = 0
-for idx, (name, lines) in enumerate(code_segments):
-    jump_marks[name] = offset
-    offset += len(lines)
+def address_labels(jump_marks: dict[str, int], length: int) -> list[str | None]:
+    labels: list[str | None] = [None] * length
+    # of several labels at one address only the last one has lines
+    for name, address in jump_marks.items():
+        if address < length:
+            labels[address] = name
+    return labels
+
 
-for segment in code_segments:
-    for idx, line in enumerate(segment[1]):
+# keyed by the source text, so recompiling an unchanged file is a lookup
+@lru_cache(COMPILE_CACHE_SIZE)
+def compile_source(source: str) -> CompiledSkript:
+    numbered = [(number, line.strip()) for number, line in enumerate(source.splitlines(), 1) if line.strip()]
+    code = [line for _, line in numbered]
+
+    vars: dict[str, int] = {}
+
+    code_segments: list[tuple[str, list[str]]] = []
+    segment_lines: list[tuple[int, list[int]]] = []
+    code_segment_index = -1
+    jump_marks: dict[str, int] = {}
+
+    for idx, line in enumerate(code):
         parts = line.split()
-        if len(parts) == 2 and parts[1].startswith("->"):
-            segment[1][idx] = f"{parts[0]} {jump_marks[parts[1][2:]]}"
+        parts = [decode_part(part, vars) for part in parts]
+        line = code[idx] = " ".join(str(i) for i in parts)
+        
+        if line.endswith(":") and not line.startswith("#"):
+            code_segments.append((line[:-1], []))
+            segment_lines.append((numbered[idx][0], []))
+            code_segment_index += 1
+        
+        else:
+            code_segments[code_segment_index][1].append(line)
+            segment_lines[code_segment_index][1].append(numbered[idx][0])
 
-out = []
-for segment in code_segments:
-    out.append("\n".join(segment[1]))
+    offset = 0
+    for idx, (name, lines) in enumerate(code_segments):
+        jump_marks[name] = offset
+        # an empty segment still emits an empty line
+        offset += len(lines) or 1
 
-    
+    for segment in code_segments:
+        for idx, line in enumerate(segment[1]):
+            parts = line.split()
+            if len(parts) == 2 and parts[1].startswith("->"):
+                segment[1][idx] = f"{parts[0]} {jump_marks[parts[1][2:]]}"
+
+    out = []
+    for segment in code_segments:
+        out.append("\n".join(segment[1]))
+
+    # an empty segment still emits an empty line, mapped to its label
+    lines = []
+    for label_line, numbers in segment_lines:
+        lines.extend(numbers or [label_line])
+
+    return CompiledSkript("\n".join(out), jump_marks, vars, lines)
 
-with open("code.txt", "w") as f_out:
-    f_out.write("\n".join(out))
\ No newline at end of file
+
+def compile_skript(source: str) -> str:
+    return compile_source(source).code
+
+
+def compile_file(path: str) -> CompiledSkript:
+    # .skript files are compiled in memory, anything else is read as code
+    # together with its source map if there is one
+    if path.endswith(RSB_SUFFIX):
+        source = Program.load(path)
+    else:
+        with open(path) as f:
+            source = f.read()
+        if path.endswith(".skript"):
+            return compile_source(source)
+    map_path = os.path.splitext(path)[0] + SOURCE_MAP_SUFFIX
+    if not os.path.exists(map_path):
+        return CompiledSkript(source, {}, {})
+    with open(map_path) as f:
+        source_map = json.load(f)
+    return CompiledSkript(source, source_map["labels"], source_map["vars"], source_map["lines"])
+
+
+def save_source_map(compiled: CompiledSkript, path: str, source_path: str):
+    with open(path, "w") as f:
+        json.dump({"source": source_path, "lines": compiled.lines,
+                   "labels": compiled.jump_marks, "vars": compiled.vars}, f, separators=(",", ":"))
+
+
+def load_program(path: str) -> str | Program:
+    return compile_file(path).code
+
+
+def map_address(address: int, old_marks: dict[str, int], new_marks: dict[str, int]) -> int:
+    # the same label plus offset after a recompile, addresses before any label
+    # or under a removed label stay where they are
+    label = None
+    for name, mark in old_marks.items():
+        # of several labels at one address only the last one has lines
+        if mark <= address and (label is None or mark >= old_marks[label]):
+            label = name
+    if label is None or label not in new_marks:
+        return address
+    return new_marks[label] + address - old_marks[label]
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else "code.skript"
+    target = sys.argv[2] if len(sys.argv) > 2 else "code.txt"
+    compiled = compile_file(source)
+    if target.endswith(RSB_SUFFIX):
+        with open(target, "wb") as f_out:
+            as_program(compiled.code).save(f_out)
+    else:
+        with open(target, "w") as f_out:
+            f_out.write(compiled.code if isinstance(compiled.code, str) else compiled.code.text())
+    save_source_map(compiled, os.path.splitext(target)[0] + SOURCE_MAP_SUFFIX, source)
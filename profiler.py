@@ -0,0 +1,81 @@
+import numpy as np
+
+from program import JUMPS
+from snapshot import BANK_COUNT
+
+
+class Profile:
+    # Counters are preallocated per address. Single steps count into lines,
+    # blocks only count their entries and are spread over their lines when
+    # the counts are read, so profiling keeps the block engine cheap.
+    def __init__(self, program_length: int):
+        self.lines = np.zeros(program_length, np.int64)
+        self.jumps_taken = np.zeros(program_length, np.int64)
+        self.block_entries = np.zeros(program_length, np.int64)
+        self.block_lengths = [0] * program_length
+        self.bank_switches = np.zeros(BANK_COUNT, np.int64)
+
+    def count_step(self, ip: int, next_ip: int):
+        self.lines[ip] += 1
+        if next_ip != ip + 1:
+            self.jumps_taken[ip] += 1
+
+    def count_block(self, start: int, length: int, next_ip: int):
+        if self.block_lengths[start] != length:
+            # the block was recompiled with another length
+            self.fold(start)
+            self.block_lengths[start] = length
+        self.block_entries[start] += 1
+        if next_ip != start + length:
+            self.jumps_taken[start + length - 1] += 1
+
+    def fold(self, start: int):
+        entries = self.block_entries[start]
+        if entries:
+            self.lines[start:start + self.block_lengths[start]] += entries
+            self.block_entries[start] = 0
+
+    def line_counts(self) -> np.ndarray:
+        counts = self.lines.copy()
+        for start in np.flatnonzero(self.block_entries):
+            counts[start:start + self.block_lengths[start]] += self.block_entries[start]
+        return counts
+
+    def report(self, program: list) -> dict:
+        counts = self.line_counts()
+        cache_reads = np.zeros(32, np.int64)
+        cache_writes = np.zeros(32, np.int64)
+        jumps = {}
+        ram_reads = ram_writes = rc = 0
+        for line, (command, count) in enumerate(zip(program, counts.tolist())):
+            if not count:
+                continue
+            name, arg = command.name, command.arg
+            if name in ("LA", "LB") and arg is not None and arg < 32:
+                cache_reads[arg] += count
+            elif name == "SVA" and arg is not None and arg < 32:
+                cache_writes[arg] += count
+            elif name == "RR":
+                ram_reads += count
+            elif name == "RW":
+                ram_writes += count
+            elif name == "RC":
+                rc += count
+            elif name in JUMPS:
+                taken = int(self.jumps_taken[line])
+                jumps[line] = {"taken": taken, "not_taken": count - taken}
+
+        hot = np.argsort(counts, kind="stable")[::-1][:10]
+        return {
+            "cycles": int(counts.sum()),
+            "lines": counts.tolist(),
+            "hot": [{"line": int(line), "command": program[line].repr(), "count": int(counts[line])}
+                    for line in hot if counts[line]],
+            "jumps": jumps,
+            "cache_reads": cache_reads.tolist(),
+            "cache_writes": cache_writes.tolist(),
+            "ram_reads": ram_reads,
+            "ram_writes": ram_writes,
+            "rc": rc,
+            "bank_switches": self.bank_switches.tolist(),
+        }
@@ -0,0 +1,267 @@
+import mmap
+import struct
+from enum import IntEnum
+from typing import BinaryIO, Iterator
+
+import numpy as np
+
+RSB_SUFFIX = ".rsb"
+RSB_MAGIC = b"RSB1"
+# magic, line count, size of the name table
+RSB_HEADER = struct.Struct("<4sII")
+# the arg column of commands without an argument
+NO_ARG = -1
+# the largest argument the int64 arg column holds
+MAX_ARG = 2 ** 63 - 1
+
+# name codes every program starts with, other names are appended per program
+NAMES = ("", "LA", "LB", "LAL", "LAH", "LBL", "LBH", "LCL", "SVA", "STP", "ADD", "SUB", "AND", "OR", "XOR",
+         "SUP", "SDN", "MUL", "INB", "RW", "RR", "RC", "JMP", "JE", "JNE", "JG", "JL", "JGE", "JLE")
+
+
+class Opcode(IntEnum):
+    NOP = 0
+    EXECUTE = 1
+    LA = 2
+    LB = 3
+    LA_INPUT = 4
+    LB_INPUT = 5
+    LAL = 6
+    LAH = 7
+    LBL = 8
+    LBH = 9
+    LCL = 10
+    SVA = 11
+    SVA_OUTPUT = 12
+    STP = 13
+    ADD = 14
+    SUB = 15
+    AND = 16
+    OR = 17
+    XOR = 18
+    SUP = 19
+    SDN = 20
+    MUL = 21
+    INB = 22
+    RW = 23
+    RR = 24
+    RC = 25
+    JMP = 26
+    JE = 27
+    JNE = 28
+    JG = 29
+    JL = 30
+    JGE = 31
+    JLE = 32
+
+
+JUMPS = {"JMP", "JE", "JNE", "JG", "JL", "JGE", "JLE"}
+NO_ARG_COMMANDS = {"STP", "ADD", "SUB", "AND", "OR", "XOR", "MUL", "INB", "RW", "RR", "RC"}
+ARG_COMMANDS = {"LA", "LB", "LAL", "LAH", "LBL", "LBH", "LCL", "SVA", "SUP", "SDN",
+                "JMP", "JE", "JNE", "JG", "JL", "JGE", "JLE"}
+
+
+class Command:
+    __slots__ = ("name", "arg")
+
+    def __init__(self, init_string: str):
+        if init_string == "":
+            self.name = ""
+            self.arg = None
+            return
+        parts = init_string.split()
+        self.name = parts[0]
+        if len(parts) > 1:
+            if parts[1].isdecimal():
+                self.arg = int(parts[1])
+            else:
+                self.arg = 0
+        else:
+            self.arg = None
+
+    @classmethod
+    def of(cls, name: str, arg: int | None) -> "Command":
+        command = cls.__new__(cls)
+        command.name = name
+        command.arg = arg
+        return command
+
+    def __eq__(self, other):
+        if not isinstance(other, Command):
+            return NotImplemented
+        return self.name == other.name and self.arg == other.arg
+
+    def __repr__(self):
+        return f"Command(name={self.name!r}, arg={self.arg!r})"
+
+    def is_input(self):
+        return (self.name == "LA" or self.name == "LB") and self.arg // 32
+
+    def repr(self):
+        if self.arg is not None:
+            return f"{self.name} {self.arg}"
+        return self.name
+
+
+class Program:
+    # A program as two parallel columns: codes into the name table and args
+    # (NO_ARG for none). Lines are handed out as Command objects built on
+    # access, so a large program costs two arrays instead of an object per
+    # line. Columns loaded from an .rsb file are read-only views of the
+    # mapped file until the first edit copies them.
+    # Inserting and deleting lines moves jump targets along with the lines
+    # they point to, using an index of the jump lines kept until the next
+    # edit.
+    def __init__(self, codes: np.ndarray, args: np.ndarray, names: list[str] | None = None):
+        self.codes = codes
+        self.args = args
+        self.names = list(names) if names is not None else list(NAMES)
+        self.name_codes = {name: code for code, name in enumerate(self.names)}
+        self.jumps: np.ndarray | None = None
+        self.targets: np.ndarray | None = None
+
+    @classmethod
+    def parse(cls, text: str) -> "Program":
+        lines = text.split("\n")
+        program = cls(np.empty(0, np.uint16), np.empty(0, np.int64))
+        # generated code repeats lines a lot, each distinct line is parsed once
+        codes, args = {}, {}
+        for line in dict.fromkeys(lines):
+            codes[line], args[line] = program.encode(Command(line))
+        program.codes = np.fromiter(map(codes.__getitem__, lines), np.uint16, len(lines))
+        program.args = np.fromiter(map(args.__getitem__, lines), np.int64, len(lines))
+        return program
+
+    @classmethod
+    def of(cls, commands: list[Command]) -> "Program":
+        program = cls(np.empty(len(commands), np.uint16), np.empty(len(commands), np.int64))
+        for i, command in enumerate(commands):
+            program.codes[i], program.args[i] = program.encode(command)
+        return program
+
+    @classmethod
+    def load(cls, path: str) -> "Program":
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, names_size = RSB_HEADER.unpack_from(data)
+        if magic != RSB_MAGIC:
+            raise ValueError(f"{path} is not an .rsb program")
+        offset = RSB_HEADER.size
+        names = data[offset:offset + names_size].decode().split("\n")
+        offset = align(offset + names_size)
+        args = np.frombuffer(data, "<i8", count, offset)
+        codes = np.frombuffer(data, "<u2", count, offset + args.nbytes)
+        return cls(codes, args, names)
+
+    def save(self, file: BinaryIO):
+        names = "\n".join(self.names).encode()
+        header = RSB_HEADER.pack(RSB_MAGIC, len(self), len(names))
+        file.write(header + names)
+        file.write(bytes(align(len(header) + len(names)) - len(header) - len(names)))
+        file.write(self.args.astype("<i8", copy=False).tobytes())
+        file.write(self.codes.astype("<u2", copy=False).tobytes())
+
+    def encode(self, command: Command) -> tuple[int, int]:
+        if command.arg is not None and command.arg > MAX_ARG:
+            raise ValueError(f"Argument of {command.name} {command.arg} is out of range")
+        code = self.name_codes.get(command.name)
+        if code is None:
+            code = self.name_codes[command.name] = len(self.names)
+            self.names.append(command.name)
+        return code, NO_ARG if command.arg is None else command.arg
+
+    def text(self) -> str:
+        names = self.names
+        return "\n".join(names[code] if arg == NO_ARG else f"{names[code]} {arg}"
+                         for code, arg in zip(self.codes.tolist(), self.args.tolist()))
+
+    def writable(self):
+        if not self.codes.flags.writeable:
+            self.codes = self.codes.copy()
+            self.args = self.args.copy()
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, idx: int | slice) -> Command | list[Command]:
+        if isinstance(idx, slice):
+            names = self.names
+            return [Command.of(names[code], None if arg == NO_ARG else arg)
+                    for code, arg in zip(self.codes[idx].tolist(), self.args[idx].tolist())]
+        arg = int(self.args[idx])
+        return Command.of(self.names[self.codes[idx]], None if arg == NO_ARG else arg)
+
+    def __iter__(self) -> Iterator[Command]:
+        return iter(self[:])
+
+    def __setitem__(self, idx: int, command: Command):
+        self.writable()
+        self.codes[idx], self.args[idx] = self.encode(command)
+        self.edited()
+
+    def insert(self, idx: int, command: Command):
+        self.move_targets(idx, 1)
+        code, arg = self.encode(command)
+        self.codes = np.insert(self.codes, idx, code)
+        self.args = np.insert(self.args, idx, arg)
+        self.edited()
+
+    def __delitem__(self, idx: int):
+        self.move_targets(idx, -1)
+        self.codes = np.delete(self.codes, idx)
+        self.args = np.delete(self.args, idx)
+        self.edited()
+
+    def swap(self, first: int, second: int):
+        # jumps to either line follow it
+        self.writable()
+        for column in (self.codes, self.args):
+            column[first], column[second] = column[second], column[first]
+        self.edited()
+        lines = self.jump_lines()
+        targets = self.args[lines]
+        self.args[lines[targets == first]] = second
+        self.args[lines[targets == second]] = first
+        self.edited()
+
+    def edited(self):
+        self.jumps = None
+        self.targets = None
+
+    def jump_lines(self) -> np.ndarray:
+        if self.jumps is None:
+            codes = [self.name_codes[name] for name in JUMPS if name in self.name_codes]
+            self.jumps = np.flatnonzero(np.isin(self.codes, codes) & (self.args != NO_ARG))
+        return self.jumps
+
+    def jump_targets(self) -> np.ndarray:
+        # sorted addresses jumped to
+        if self.targets is None:
+            self.targets = np.unique(self.args[self.jump_lines()])
+        return self.targets
+
+    def move_targets(self, idx: int, delta: int):
+        # the moved_address() rule for every jump
+        lines = self.jump_lines()
+        targets = self.args[lines]
+        moved = lines[targets >= idx] if delta > 0 else lines[targets > idx]
+        if len(moved):
+            self.writable()
+            self.args[moved] += delta
+
+
+def moved_address(address: int, idx: int, delta: int) -> int:
+    # where an address ends up after inserting (delta 1) or deleting (delta -1)
+    # line idx, the lines from idx on move down on an insert, the ones after
+    # idx move up on a delete
+    if address > idx or (delta > 0 and address == idx):
+        return address + delta
+    return address
+
+
+def align(offset: int) -> int:
+    return offset + 7 & ~7
+
+
+def as_program(code: "str | Program") -> Program:
+    return code if isinstance(code, Program) else Program.parse(code)
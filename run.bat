@@ -1 +1 @@
-python -c "import preprocessor; import main"
\ No newline at end of file
+python main.py code.skript
\ No newline at end of file
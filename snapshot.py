@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from typing import BinaryIO, Sequence
+
+import numpy as np
+
+BANK_SIZE = 16
+BANK_COUNT = 64
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    instruction_pointer: int
+    clock_cycle: int
+    registers: tuple[int, int, int]
+    running: bool
+    loaded_bank_index: int
+    screen_position: tuple[int, int] | None
+    cache_slots: np.ndarray
+    # RAM is stored bank by bank so unchanged banks can be shared between snapshots
+    ram_banks: tuple[np.ndarray, ...]
+    inputs: np.ndarray
+    screen: np.ndarray
+    screenbuffer: np.ndarray
+    ticks: int = 0
+
+    def ram(self) -> np.ndarray:
+        return np.concatenate(self.ram_banks)
+
+
+def frozen_copy(array: np.ndarray, previous: np.ndarray | None) -> np.ndarray:
+    if previous is not None and np.array_equal(array, previous):
+        return previous
+    array = array.copy()
+    array.flags.writeable = False
+    return array
+
+
+def share_banks(banks: Sequence[np.ndarray], previous: Snapshot | None) -> tuple[np.ndarray, ...]:
+    if previous is None:
+        return tuple(frozen_copy(bank, None) for bank in banks)
+    return tuple(frozen_copy(bank, old) for bank, old in zip(banks, previous.ram_banks))
+
+
+def save(snapshot: Snapshot, file: BinaryIO):
+    x, y = snapshot.screen_position if snapshot.screen_position is not None else (-1, -1)
+    meta = np.array([snapshot.instruction_pointer, snapshot.clock_cycle, *snapshot.registers,
+                     snapshot.running, snapshot.loaded_bank_index, x, y, snapshot.ticks], np.int64)
+    np.savez_compressed(file, meta=meta, cache_slots=snapshot.cache_slots, ram=snapshot.ram(),
+                        inputs=snapshot.inputs, screen=np.packbits(snapshot.screen),
+                        screenbuffer=np.packbits(snapshot.screenbuffer))
+
+
+def load(file: BinaryIO) -> Snapshot:
+    with np.load(file) as data:
+        ip, clock_cycle, a, b, c, running, bank, x, y, ticks = data["meta"].tolist()
+        return Snapshot(
+            instruction_pointer=ip,
+            clock_cycle=clock_cycle,
+            registers=(a, b, c),
+            running=bool(running),
+            loaded_bank_index=bank,
+            screen_position=None if x < 0 else (x, y),
+            cache_slots=frozen_copy(data["cache_slots"], None),
+            ram_banks=share_banks(data["ram"].reshape(BANK_COUNT, BANK_SIZE), None),
+            inputs=frozen_copy(data["inputs"], None),
+            screen=frozen_copy(np.unpackbits(data["screen"]).astype(bool).reshape(64, 64), None),
+            screenbuffer=frozen_copy(np.unpackbits(data["screenbuffer"]).astype(bool).reshape(64, 64), None),
+            ticks=ticks,
+        )
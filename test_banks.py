@@ -0,0 +1,179 @@
+import random
+
+import numpy as np
+import pytest
+
+from computer import Computer
+from journal import Journal
+from snapshot import BANK_COUNT, BANK_SIZE
+
+
+class CopyBackBanks:
+    # the bank model before offset addressing: the first bank starts out as
+    # an array of its own, RR/RW go to the loaded bank and RC copies it back
+    # into ram before loading the next one
+    def __init__(self):
+        self.ram = np.zeros(BANK_COUNT * BANK_SIZE, np.int16)
+        self.loaded_bank = np.zeros(BANK_SIZE, np.int16)
+        self.loaded_bank_index = 0
+
+    def rw(self, a: int, b: int):
+        self.loaded_bank[b % 16] = a
+
+    def rr(self, b: int) -> int:
+        return int(self.loaded_bank[b % 16])
+
+    def rc(self, b: int):
+        bank = (b // 16) % 64
+        if bank != self.loaded_bank_index:
+            start = self.loaded_bank_index * 16
+            self.ram[start:start + 16] = self.loaded_bank
+            self.loaded_bank = self.ram[bank * 16:(bank + 1) * 16]
+            self.loaded_bank_index = bank
+
+    def merged_ram(self) -> np.ndarray:
+        ram = self.ram.copy()
+        start = self.loaded_bank_index * 16
+        ram[start:start + 16] = self.loaded_bank
+        return ram
+
+
+def load_b(value: int) -> list[str]:
+    return [f"LBL {value & 255}", f"LBH {value >> 8 & 255}"]
+
+
+def bank_walk() -> str:
+    # writes bank + cell into a few cells of every bank, then reads them back
+    # from the last bank to the first
+    lines = []
+    for bank in range(BANK_COUNT):
+        for cell in (0, 7, 15):
+            lines += load_b(bank * 16 + cell) + ["RC", f"LAL {bank}", f"LAH {cell}", "RW"]
+    for bank in reversed(range(BANK_COUNT)):
+        for cell in (15, 0):
+            lines += load_b(bank * 16 + cell) + ["RC", "RR", f"SVA {cell % 32}"]
+    return "\n".join(lines + ["STP"])
+
+
+def random_bank_program(rng: random.Random, length: int) -> str:
+    lines = []
+    for _ in range(length):
+        match rng.randrange(6):
+            case 0:
+                lines += load_b(rng.randrange(BANK_COUNT * BANK_SIZE))
+            case 1:
+                lines.append("RC")
+            case 2:
+                lines += [f"LAL {rng.randrange(256)}", "RW"]
+            case 3:
+                lines += ["RR", f"SVA {rng.randrange(32)}"]
+            case 4:
+                lines.append("INB")
+            case 5:
+                lines += [f"LA {rng.randrange(32)}", "RW"]
+    return "\n".join(lines + ["STP"])
+
+
+def run_against_copy_back(source: str, **options) -> Computer:
+    computer = Computer(source, **options)
+    reference = CopyBackBanks()
+    state = computer.state
+    while state.running:
+        command = state.program_data[state.instruction_pointer]
+        a, b = state.a, state.b
+        computer.step()
+        if command.name == "RW":
+            reference.rw(a, b)
+        elif command.name == "RR":
+            assert state.a == reference.rr(b)
+        elif command.name == "RC":
+            reference.rc(b)
+        assert state.loaded_bank_index == reference.loaded_bank_index
+        assert np.array_equal(state.loaded_bank, reference.loaded_bank)
+    assert np.array_equal(state.ram, reference.merged_ram())
+    return computer
+
+
+@pytest.mark.parametrize("options", [{"compiled": False}, {}, {"blocks": True}])
+def test_bank_walk_matches_copy_back(options):
+    computer = run_against_copy_back(bank_walk(), **options)
+    ram = computer.state.ram.reshape(BANK_COUNT, BANK_SIZE)
+    for bank in range(BANK_COUNT):
+        for cell in (0, 7, 15):
+            assert ram[bank, cell] == bank | cell << 8
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_bank_programs_match_copy_back(seed):
+    rng = random.Random(seed)
+    run_against_copy_back(random_bank_program(rng, 200))
+
+
+def test_blocks_match_interpreter():
+    source = random_bank_program(random.Random(99), 400)
+    first, second = Computer(source, compiled=False), Computer(source, blocks=True)
+    first.run(10_000)
+    second.run(10_000)
+    assert np.array_equal(first.state.ram, second.state.ram)
+    assert first.state.loaded_bank_index == second.state.loaded_bank_index
+
+
+def test_switch_back_to_bank_zero_keeps_writes():
+    source = "\n".join(["LAL 11", "LBL 3", "RW"]
+                       + load_b(5 * 16 + 3) + ["RC", "LAL 22", "RW"]
+                       + load_b(3) + ["RC", "RR", "SVA 0"]
+                       + load_b(5 * 16 + 3) + ["RC", "RR", "SVA 1", "STP"])
+    computer = run_against_copy_back(source)
+    state = computer.state
+    assert state.cache_slots[0] == 11
+    assert state.cache_slots[1] == 22
+    assert state.ram[3] == 11
+    assert state.ram[5 * 16 + 3] == 22
+    assert state.loaded_bank_index == 5
+
+
+def forward_states(computer: Computer) -> list[tuple]:
+    states = []
+    state = computer.state
+    while state.running:
+        states.append((state.clock_cycle, state.loaded_bank_index, state.ram.copy(), state.loaded_bank.copy()))
+        computer.step()
+    return states
+
+
+@pytest.mark.parametrize("max_entries", [1_000_000, 50])
+def test_journal_undoes_bank_writes_and_switches(max_entries):
+    # with few entries most of the history is rebuilt from checkpoints
+    source = random_bank_program(random.Random(7), 150)
+    computer = Computer(source)
+    computer.journal = Journal(max_entries=max_entries, checkpoint_interval=40)
+    states = forward_states(computer)
+    for clock_cycle, loaded_bank_index, ram, loaded_bank in reversed(states):
+        assert computer.step_back() is not False
+        state = computer.state
+        assert state.clock_cycle == clock_cycle
+        assert state.loaded_bank_index == loaded_bank_index
+        assert np.array_equal(state.ram, ram)
+        assert np.array_equal(state.loaded_bank, loaded_bank)
+    assert computer.step_back() is False
+
+
+def test_snapshot_restores_banks():
+    source = bank_walk()
+    computer = Computer(source)
+    computer.run(500)
+    snapshot = computer.snapshot()
+    ram, loaded_bank_index = computer.state.ram.copy(), computer.state.loaded_bank_index
+    computer.run(1000)
+    finished = computer.state.ram.copy()
+    assert not np.array_equal(finished, ram)
+
+    computer.restore(snapshot)
+    assert computer.state.loaded_bank_index == loaded_bank_index
+    assert np.array_equal(computer.state.ram, ram)
+    start = loaded_bank_index * BANK_SIZE
+    assert np.array_equal(computer.state.loaded_bank, ram[start:start + BANK_SIZE])
+    # writes after the restore don't reach the snapshot
+    computer.run(1000)
+    assert np.array_equal(computer.state.ram, finished)
+    assert np.array_equal(snapshot.ram(), ram)
@@ -0,0 +1,45 @@
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+DEFAULT_TIMING = "timing.json"
+
+
+@dataclass
+class TimingModel:
+    # in-game redstone ticks per instruction, looked up by command name, with
+    # SVA to an output register priced by register
+    default: int = 1
+    opcodes: dict[str, int] = field(default_factory=dict)
+    outputs: dict[int, int] = field(default_factory=dict)
+    ticks_per_second: float = 10.0
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_TIMING) -> "TimingModel":
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get("default", 1), data.get("opcodes", {}),
+                   {int(register): ticks for register, ticks in data.get("outputs", {}).items()},
+                   data.get("ticks_per_second", 10.0))
+
+    def costs(self, program) -> list[int]:
+        # tick cost of every line, per name code and then per output write
+        costs = np.array([self.opcodes.get(name, self.default) for name in program.names], np.int64)[program.codes]
+        if self.outputs:
+            sva = self.opcodes.get("SVA", self.default)
+            outputs = np.array([self.outputs.get(register, sva) for register in range(32)], np.int64)
+            lines = (program.codes == program.name_codes.get("SVA", -1)) & (program.args >= 32)
+            costs[lines] = outputs[program.args[lines] % 32]
+        return costs.tolist()
+
+    def seconds(self, ticks: int) -> float:
+        return ticks / self.ticks_per_second
+
+    def report(self, cycles: int, ticks: int) -> dict:
+        return {
+            "cycles": cycles,
+            "ticks": ticks,
+            "ticks_per_cycle": ticks / cycles if cycles else 0.0,
+            "in_game_seconds": self.seconds(ticks),
+        }
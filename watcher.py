@@ -0,0 +1,57 @@
+import os
+import queue
+import threading
+from dataclasses import dataclass
+
+from preprocessor import CompiledSkript, compile_file
+from program import Program, as_program
+
+POLL_INTERVAL = 0.25
+
+
+@dataclass
+class Reload:
+    compiled: CompiledSkript | None
+    program: Program | None
+    error: Exception | None = None
+
+
+class SourceWatcher:
+    # Polls a source file on a background thread and compiles it there when it
+    # changes, so large sources don't stall the UI. poll() hands the newest
+    # result to the UI thread.
+    def __init__(self, path: str, interval: float = POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.results: queue.Queue[Reload] = queue.Queue()
+        self.mtime = self.stat()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    def stat(self) -> int | None:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            mtime = self.stat()
+            if mtime is None or mtime == self.mtime:
+                continue
+            self.mtime = mtime
+            try:
+                compiled = compile_file(self.path)
+                self.results.put(Reload(compiled, as_program(compiled.code)))
+            except Exception as e:
+                self.results.put(Reload(None, None, e))
+
+    def poll(self) -> Reload | None:
+        latest = None
+        while not self.results.empty():
+            latest = self.results.get_nowait()
+        return latest
+
+    def stop(self):
+        self.stopped.set()